@@ -1,31 +1,49 @@
 from __future__ import annotations
 
+import heapq
+import itertools
 import logging
-import requests
-
-from datetime import datetime, timedelta
-from enum import Enum
-from typing import Any, Callable, List
+import time
+import uuid
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from enum import IntEnum
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Tuple
 from PySide6.QtCore import (
     QObject,
     QThreadPool,
     QRunnable,
     QMutex,
     QTimer,
+    QWaitCondition,
     Signal,
     Slot,
 )
 
-from .aim_session import AimSession
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
+from urllib3.exceptions import HTTPError as DriverConnectionError
+
+from .aim_session import AimSession, NotSavedError
+from .hrc import classify
+from .job_store import FAILED, QUEUED, RUNNING, JobStore
+from .notify import NtfyDispatcher
+from .phase_api import PhaseApi
+from .schedule import RefreshScheduler
+from .session_pool import SessionPool
 from .settings import CONFIG
+from .triage import JobAction, JobPlan, TriageEngine, merge_plans
+from .worklist_diff import ChangeTracker, WorklistDiff
 from .worklist import (
+    RESPONSES,
     Workorder,
+    authenticate,
     get_shop_assignments,
-    guess_hrc,
-    has_keyword_regex,
-    has_no_hrc,
-    is_past_due,
     get_workorders,
+    iter_workorders,
+    join_assignments,
+    new_session,
 )
 
 logger = logging.getLogger(__name__)
@@ -33,20 +51,12 @@ if CONFIG.debug:
     logger.setLevel(logging.DEBUG)
 
 DISABLE_FETCH = False
-MSG = "New Urgent work request(s)"
-AIM_URL_TEMPLATE = "https://washington.assetworks.hosting/fmax/screen/PHASE_VIEW?proposal={}&sortCode={}"
 INTERVAL = 5 * 60 * 1000
-# CANCEL_REGEX = "\\b(an(n)ual.*Maintenance|pm$)\\b"
-# HOLD_REGEX = "fire|transfer switch"
-URGENT = ("300 HIGH", "200 URGENT", "100 EMERGENCY")
-
-
-class JobAction(Enum):
-    ADD_HRC = 0
-    ASSIGN = 1
-    CANCEL = 2
-    DE_ESCALATE = 3
-    HOLD = 4
+# how long an idle worker waits for more jobs before giving back its browser
+IDLE_WAIT = 1000
+MAX_BACKOFF = 300
+# raised by Selenium's connection to chromedriver once the driver has died
+DRIVER_GONE = (DriverConnectionError, ConnectionError)
 
 
 class Runnable(QRunnable):
@@ -64,13 +74,65 @@ class Runnable(QRunnable):
         self._run()
 
 
+class JobPriority(IntEnum):
+    """Lower runs first"""
+
+    INTERACTIVE = 0  # the user is waiting on it, e.g. creating a workorder
+    USER = 1  # started from the GUI, e.g. guessing HRCs
+    BACKGROUND = 2  # found by the fetcher
+
+
 class Job(object):
     def __init__(
-        self, action: Callable, data: Any, description: str = "Processing..."
+        self,
+        action: Callable,
+        data: Any,
+        description: str = "Processing...",
+        http_action: Callable | None = None,
+        priority: JobPriority = JobPriority.BACKGROUND,
+        key: Hashable | None = None,
+        retryable: bool = True,
     ) -> None:
         self.action = action
         self.data = data
         self.description = description
+        # tried first, without a browser. action runs if it returns False
+        self.http_action = http_action
+        self.priority = priority
+        # jobs with the same key do the same thing, so only one is queued
+        self.key = key if key is not None else uuid.uuid4().hex
+        # False for actions that must not run twice, e.g. creating a workorder
+        self.retryable = retryable
+        self.attempts = 0
+
+    def record(self) -> dict:
+        """Plain form of the job for the JobStore"""
+        data = dict(self.data) if isinstance(self.data, Workorder) else self.data
+        return dict(
+            key=self.key,
+            action=self.action.__name__,
+            http_action=self.http_action.__name__ if self.http_action else None,
+            data=dict(workorder=data) if isinstance(self.data, Workorder) else data,
+            description=self.description,
+            priority=int(self.priority),
+            retryable=self.retryable,
+        )
+
+    @classmethod
+    def from_record(cls, record: dict) -> Job:
+        data = record["data"]
+        if isinstance(data, dict) and "workorder" in data:
+            data = Workorder(data["workorder"])
+        http_action = record["http_action"]
+        return cls(
+            JOB_FUNCTIONS[record["action"]],
+            data,
+            record["description"],
+            JOB_FUNCTIONS[http_action] if http_action else None,
+            JobPriority(record["priority"]),
+            record["key"],
+            record.get("retryable", True),
+        )
 
     def __repr__(self) -> str:
         return f"""
@@ -81,38 +143,114 @@ class Job(object):
     """
 
 
-class JobQue(object):
-    """Wrapper class allowing threa-safe access to shared list"""
+class JobScheduler(object):
+    """
+    Thread-safe priority queue of jobs, merging duplicates.
+
+    Jobs run by priority class, oldest first within a class. Adding a job
+    whose key is already queued replaces the queued job's data and keeps
+    the more urgent priority; adding one whose key is running is dropped.
+    A job added with a delay waits aside until it is due.
+    """
 
     def __init__(self) -> None:
-        self.__jobs = list()
+        # [priority, sequence, job], job is None once superseded
+        self.__heap: List[list] = list()
+        # (due, sequence, entry) for jobs added with a delay
+        self.__delayed: List[Tuple[float, int, list]] = list()
+        self.__queued: Dict[Hashable, list] = dict()
+        self.__running: set = set()
+        self.__counter = itertools.count()
+        self.merged = 0
         self.mutex = QMutex()
+        self.not_empty = QWaitCondition()
 
     def __bool__(self) -> bool:
-        self.mutex.lock()
-        r = bool(self.__jobs)
-        self.mutex.unlock()
-        return r
+        return len(self) > 0
 
     def __len__(self) -> int:
         self.mutex.lock()
-        r = len(self.__jobs)
+        r = len(self.__queued)
         self.mutex.unlock()
         return r
 
     def __repr__(self) -> str:
-        return self.__jobs.__repr__()
+        return f"JobScheduler(depth={self.depth()}, merged={self.merged})"
 
-    def add_job(self, job) -> None:
+    def depth(self) -> Dict[str, int]:
+        """Number of queued jobs in each priority class"""
         self.mutex.lock()
-        self.__jobs.append(job)
+        r = {p.name: 0 for p in JobPriority}
+        for _, _, job in self.__queued.values():
+            r[job.priority.name] += 1
         self.mutex.unlock()
+        return r
 
-    def pop(self) -> Job:
+    def add_job(self, job: Job, delay: float = 0) -> bool:
+        """
+        Queue a job, returning False if it was merged into one already queued or running
+        :param delay: float -> seconds before the job may run
+        """
+        self.mutex.lock()
+        try:
+            if job.key in self.__running:
+                self.merged += 1
+                return False
+            queued = self.__queued.get(job.key)
+            if queued is not None:
+                self.merged += 1
+                job.attempts = max(job.attempts, queued[2].attempts)
+                if job.priority >= queued[0]:
+                    job.priority = queued[0]
+                    queued[2] = job
+                    return False
+                # more urgent now: retire the old entry and queue again
+                queued[2] = None
+            entry = [job.priority, next(self.__counter), job]
+            self.__queued[job.key] = entry
+            if delay > 0:
+                heapq.heappush(self.__delayed, (time.monotonic() + delay, entry[1], entry))
+            else:
+                heapq.heappush(self.__heap, entry)
+            self.not_empty.wakeOne()
+            return queued is None
+        finally:
+            self.mutex.unlock()
+
+    def pop(self, timeout: int = 0) -> Job | None:
+        """
+        Take the most urgent job and mark it running
+        :param timeout: int -> milliseconds to wait for a job, 0 to return at once.
+            While delayed jobs are pending a waiting caller stays until they are due.
+        """
         self.mutex.lock()
-        r = self.__jobs.pop(0)
+        try:
+            while True:
+                now = time.monotonic()
+                while self.__delayed and self.__delayed[0][0] <= now:
+                    heapq.heappush(self.__heap, heapq.heappop(self.__delayed)[2])
+                while self.__heap:
+                    _, _, job = heapq.heappop(self.__heap)
+                    if job is None:
+                        continue
+                    del self.__queued[job.key]
+                    self.__running.add(job.key)
+                    return job
+                if timeout <= 0:
+                    return None
+                wait = timeout
+                if self.__delayed:
+                    wait = max(wait, int((self.__delayed[0][0] - now) * 1000) + 1)
+                if not self.not_empty.wait(self.mutex, wait) and not self.__delayed:
+                    return None
+        finally:
+            self.mutex.unlock()
+
+    def done(self, job: Job) -> None:
+        """Allow the job's key to be queued again"""
+        self.mutex.lock()
+        self.__running.discard(job.key)
         self.mutex.unlock()
-        return r
 
 
 class AimProcessor(QObject):
@@ -121,231 +259,495 @@ class AimProcessor(QObject):
     progress = Signal(int, int)
     message = Signal(str)
     error = Signal(str)
+    # description and reason of a job given up on
+    dead_letter = Signal(str)
 
-    def __init__(self, parent: QObject = None) -> None:
+    def __init__(self, store: JobStore | None = None, parent: QObject = None) -> None:
         super().__init__(parent)
-        self.jobs = JobQue()
+        self.jobs = JobScheduler()
+        self.store = store or JobStore()
+        self.pool = SessionPool(CONFIG.workers)
+        self.api = PhaseApi()
+        self.workers = QThreadPool(self)
+        self.mutex = QMutex()
         self.active = False
         self._total_jobs = 0
+        self._completed = 0
+        # job key -> (deadline, browser running it)
+        self._deadlines: Dict[Hashable, Tuple[float, AimSession | None]] = dict()
+        self._expired: set = set()
+        self.watchdog = QTimer(self)
+        self.watchdog.timeout.connect(self.check_deadlines)
+        self.watchdog.start(1000)
 
     def add_job(self, job: Job) -> None:
-        QThreadPool.globalInstance().start(Runnable(self.run_one, job))
+        self.add_jobs([job])
 
     @Slot(list)
     def add_jobs(self, jobs: list[Job]) -> None:
-        self._total_jobs += len(jobs)
-        for job in jobs:
-            self.jobs.add_job(job)
-        if not self.active:
+        self.store.put(job.record() for job in jobs)
+        added = sum(self.jobs.add_job(job) for job in jobs)
+        logger.debug(f"{added} of {len(jobs)} jobs queued: {self.jobs}")
+        self.mutex.lock()
+        self._total_jobs += added
+        start = not self.active
+        self.active = True
+        self.mutex.unlock()
+        if start:
             QThreadPool.globalInstance().start(Runnable(self.run))
 
-    def run_one(self, job: Job) -> None:
-        logger.debug(f"{self.__class__}: run_one")
-        logger.debug(job)
-        self.active = True
-        self.started.emit()
-        try:
-            with AimSession(netid=CONFIG.netid, debug=CONFIG.debug) as aim:
+    def resume(self) -> None:
+        """Queue again the jobs a previous run left unfinished"""
+        jobs = list()
+        for record in self.store.pending():
+            if record["state"] == RUNNING and not record["retryable"]:
+                # it may have finished before the app stopped
+                self.store.set_state(record["key"], FAILED, "interrupted, check AiM")
+                continue
+            try:
+                jobs.append(Job.from_record(record))
+            except (KeyError, ValueError, TypeError) as e:
+                logger.error(f"can't resume job {record}: {e}")
+                self.store.set_state(record["key"], FAILED, f"can't resume: {e}")
+        if jobs:
+            logger.debug(f"resuming {len(jobs)} unfinished jobs")
+            self.add_jobs(jobs)
+        for record in self.store.failed():
+            self.dead_letter.emit(f"{record['description']}: {record['error']}")
 
-                aim.progress.connect(self.progress.emit)
-                aim.message.connect(self.message.emit)
-                job.action(aim, job.data)
-        except Exception as e:
-            self.error.emit(e)
-        self.active = False
-        self.message.emit("Done")
-        self.finished.emit()
+    @Slot()
+    def retry_failed(self) -> None:
+        """Give every dead-lettered job a fresh set of attempts"""
+        jobs = list()
+        for record in self.store.failed():
+            try:
+                jobs.append(Job.from_record(record))
+            except (KeyError, ValueError, TypeError) as e:
+                logger.error(f"can't retry job {record}: {e}")
+        if jobs:
+            self.add_jobs(jobs)
 
     def run(self) -> None:
-        if not self.jobs:
-            return
-        self.active = True
-        completed = 0
+        self._completed = 0
         self.started.emit()
-        logger.debug(f"{self.__class__}: run: ")
-
-        try:
-            with AimSession(netid=CONFIG.netid, debug=CONFIG.debug) as aim:
-
-                while self.jobs:
-                    self.progress.emit(completed, self._total_jobs - 1)
-                    job = self.jobs.pop()
-                    if job.action.__name__ == "make_daily_assignment":
-                        logger.debug(job.action.__name__)
-                        aim.progress.connect(self.progress.emit)
-                    else:
-                        self.progress.emit(completed, self._total_jobs - 1)
-                    logger.debug(job.description)
-                    self.message.emit(job.description)
-                    job.action(aim, job.data)
-                    if job.action.__name__ == "make_daily_assignment":
-                        aim.progress.disconnect()
-                    completed += 1
-        except Exception as e:
-            logger.debug(e)
-            self.error.emit(str(e))
-        self.active = False
-        self._total_jobs = 0
+        while True:
+            workers = max(1, min(CONFIG.workers, len(self.jobs)))
+            logger.debug(f"{self.__class__}: run: {workers} worker(s)")
+
+            self.pool.size = CONFIG.workers
+            self.workers.setMaxThreadCount(workers)
+            for _ in range(workers):
+                self.workers.start(Runnable(self._work))
+            self.workers.waitForDone()
+
+            # jobs added while the last worker was leaving get another round
+            self.mutex.lock()
+            if not self.jobs:
+                self.active = False
+                self._total_jobs = 0
+                self.mutex.unlock()
+                break
+            self.mutex.unlock()
         self.message.emit("Done")
         self.finished.emit()
 
+    def _work(self) -> None:
+        """
+        Drain the job queue, starting a browser session only when a job needs
+        one. A failed job is retried later or dead-lettered, and the worker
+        moves on to the next.
+        """
+        aim = None
+        # browser failures in a row on this worker's driver
+        failures = 0
+        while (job := self.jobs.pop(IDLE_WAIT)) is not None:
+            self.progress.emit(self._completed, self._total_jobs - 1)
+            logger.debug(job.description)
+            self.message.emit(job.description)
+            self.store.set_state(job.key, RUNNING)
+            job.attempts += 1
+            deadline = time.monotonic() + CONFIG.job_timeout
+            self._watch(job, None, deadline)
+            error = None
+            transient = False
+            in_browser = False
+            try:
+                if not self._try_http(job):
+                    if aim is None:
+                        aim = self.pool.acquire()
+                    self._watch(job, aim, deadline)
+                    in_browser = True
+                    self._run_job(aim, job)
+            except Exception as e:
+                expired = self._unwatch(job)
+                # e.g. urllib3's MaxRetryError: the driver is unusable, while
+                # application errors say nothing about the browser
+                dead = in_browser and isinstance(e, DRIVER_GONE)
+                browser = expired or dead or isinstance(e, WebDriverException)
+                # a change AiM did not confirm is worth another attempt
+                transient = browser or isinstance(e, NotSavedError)
+                error = f"timed out after {CONFIG.job_timeout}s" if expired else str(e).strip()
+                logger.debug(f"{job.description} failed, attempt {job.attempts}: {error}")
+                if browser and aim is not None:
+                    failures += 1
+                    if (
+                        expired
+                        or dead
+                        or isinstance(e, InvalidSessionIdException)
+                        or failures >= CONFIG.recycle_after
+                    ):
+                        logger.debug("recycling browser")
+                        self.pool.release(aim, discard=True)
+                        aim = None
+                        failures = 0
+            else:
+                self._unwatch(job)
+                failures = 0
+                self.store.complete(job.key)
+            finally:
+                self.jobs.done(job)
+            if error is not None and self._retry(job, error, transient):
+                continue
+            self.mutex.lock()
+            self._completed += 1
+            self.mutex.unlock()
+        if aim is not None:
+            self.pool.release(aim)
+
+    def _retry(self, job: Job, error: str, transient: bool) -> bool:
+        """Queue a failed job again after a backoff, or dead-letter it"""
+        if transient and job.retryable and job.attempts < CONFIG.job_retries:
+            delay = min(CONFIG.retry_delay * 2 ** (job.attempts - 1), MAX_BACKOFF)
+            self.store.set_state(job.key, QUEUED, error)
+            self.jobs.add_job(job, delay)
+            self.message.emit(f"{job.description}: retrying in {delay}s")
+            return True
+        self.store.set_state(job.key, FAILED, error)
+        self.dead_letter.emit(f"{job.description}: {error}")
+        if job.priority < JobPriority.BACKGROUND:
+            # the user started it and is waiting on the result
+            self.error.emit(f"{job.description} failed: {error}")
+        return False
+
+    def _watch(self, job: Job, aim: AimSession | None, deadline: float) -> None:
+        self.mutex.lock()
+        self._deadlines[job.key] = (deadline, aim)
+        self.mutex.unlock()
+
+    def _unwatch(self, job: Job) -> bool:
+        """Stop watching a job, returning True if the watchdog stopped it"""
+        self.mutex.lock()
+        self._deadlines.pop(job.key, None)
+        expired = job.key in self._expired
+        self._expired.discard(job.key)
+        self.mutex.unlock()
+        return expired
+
+    @Slot()
+    def check_deadlines(self) -> None:
+        """Stop browsers stuck on a job past its deadline, failing the job"""
+        now = time.monotonic()
+        self.mutex.lock()
+        stuck = [
+            (key, aim)
+            for key, (deadline, aim) in self._deadlines.items()
+            if deadline < now and aim is not None and key not in self._expired
+        ]
+        self._expired.update(key for key, _ in stuck)
+        self.mutex.unlock()
+        for key, aim in stuck:
+            logger.debug(f"job {key} is past its deadline, stopping its browser")
+            aim.quit()
+
+    def _try_http(self, job: Job) -> bool:
+        if not CONFIG.http_writes or job.http_action is None:
+            return False
+        if job.http_action(self.api, job.data):
+            return True
+        logger.debug(f"falling back to browser for {job.description}")
+        return False
+
+    def _run_job(self, aim: AimSession, job: Job) -> None:
+        # pass on the session's own steps for jobs the user is watching
+        forwarded = list()
+        if job.priority == JobPriority.INTERACTIVE:
+            forwarded = [(aim.progress, self.progress), (aim.message, self.message)]
+        elif job.action.__name__ == "make_daily_assignment":
+            forwarded = [(aim.progress, self.progress)]
+        for source, target in forwarded:
+            source.connect(target.emit)
+        try:
+            job.action(aim, job.data)
+        finally:
+            for source, target in forwarded:
+                source.disconnect(target.emit)
+
+    @Slot()
+    def reap_sessions(self) -> None:
+        if not self.active:
+            self.pool.reap()
+
+    @Slot()
+    def shutdown(self) -> None:
+        self.watchdog.stop()
+        logger.debug(f"shutting down session pool: {self.pool}")
+        self.pool.close_all()
+
 
 class AimFetcher(QObject):
     new_jobs = Signal(list)
     new_urgent = Signal(list)
-    new_worklist = Signal(list)
+    # WorklistDiff of the new and active queries since the last fetch
+    worklist_changed = Signal(object)
 
-    def __init__(self, parent: QObject = None) -> None:
+    def __init__(self, store: JobStore | None = None, parent: QObject = None) -> None:
         super().__init__(parent)
 
+        self.store = store or JobStore()
         self.new_workorders = list()
         self.active_workorders = list()
-        self.last_run = datetime.now().astimezone()
-
-    @Slot()
-    def fetch(self) -> None:
-        QThreadPool.globalInstance().start(self.run)
+        self.triage = TriageEngine(self)
+        self.changes = {"new": ChangeTracker(), "active": ChangeTracker()}
+        # query key -> start of its last fetch
+        started = datetime.now().astimezone()
+        self.last_run = {source: started for source in CONFIG.queries}
+        self.mutex = QMutex()
+        self.in_flight = False
+        # queries due while a fetch was running, fetched right after it
+        self._due = set()
+        # requests merged into a running fetch instead of starting one
+        self.skipped = 0
+        # seconds taken by recent fetches, newest last
+        self.durations = deque(maxlen=20)
+        CONFIG.has_changed.connect(self.on_config_changed)
+
+    @Slot(str)
+    def on_config_changed(self, key: str) -> None:
+        if not self.triage.depends_on(key):
+            return
+        # rules or queries changed: plan every record again
+        for tracker in self.changes.values():
+            tracker.reset()
 
-    def run(self) -> None:
+    @Slot(list)
+    def fetch(self, sources: List[str] | None = None) -> None:
+        """
+        Fetch the given queries, all of them by default. While a fetch is
+        running, the queries are merged into one fetch started after it.
+        """
+        self.mutex.lock()
+        self._due.update(sources or CONFIG.queries)
+        busy = self.in_flight
+        if busy:
+            self.skipped += 1
+        self.in_flight = True
+        self.mutex.unlock()
+        if busy:
+            logger.debug(f"fetch still running, {self.skipped} request(s) merged so far")
+            return
+        QThreadPool.globalInstance().start(self._run_due)
+
+    def _run_due(self) -> None:
+        while True:
+            self.mutex.lock()
+            due, self._due = self._due, set()
+            if not due:
+                self.in_flight = False
+                self.mutex.unlock()
+                return
+            self.mutex.unlock()
+            start = time.monotonic()
+            try:
+                self.run(due)
+            except Exception as e:
+                logger.error(f"fetch failed: {e}")
+            self.mutex.lock()
+            self.durations.append(time.monotonic() - start)
+            self.mutex.unlock()
+            logger.debug(f"fetch of {sorted(due)} took {self.durations[-1]:.1f}s")
+
+    def run(self, due: Iterable[str] = ()) -> None:
 
         if DISABLE_FETCH:
             return
+        due = set(due) or set(CONFIG.queries)
+        started = datetime.now().astimezone()
         # fetch and sort workorders
-        logger.debug(f"{self.__class__}: last_run {self.last_run}")
-        logger.debug("Fetching workorders...")
-        self.new_workorders = get_workorders("17 Elec New Work")
-        self.active_workorders = get_workorders("17 Elec All Active")
-
-        # fetch shop assignments and add to active workorders
-        logger.debug("fetching assignments")
-        assignments = get_shop_assignments(self.active_workorders)
-        for w in self.active_workorders:
-            w["shopPerson"] == ""
-            for a in assignments:
-                if a["proposal"] == w["proposal"] and a["sortCode"] == w["sortCode"]:
-                    if a["primaryYn"] == "Y":
-                        w["primary"] = a["shopPerson"]
-                        logger.debug(
-                            f"adding {a['shopPerson']} as primary for {w['proposal']}-{w['sortCode']}"
-                        )
-                        break
-                    if a["primaryYn"] == "N":
-                        w["shopPerson"] = a["shopPerson"]
-                        logger.debug(
-                            f"adding {a['shopPerson']} as shopPerson for {w['proposal']}-{w['sortCode']}"
-                        )
-                        break
-
-        open_active = list()
-        open_active.extend(self.new_workorders)
-        open_active.extend(self.active_workorders)
-        self.new_worklist.emit(open_active)
-
-        logger.debug("parsing past due...")
-        pastdue = [wo for wo in self.active_workorders if is_past_due(wo)]
-
-        logger.debug("parsing pm's...")
-        real_pms = [
-            wo
-            for wo in self.new_workorders
-            if has_keyword_regex(wo, CONFIG.hold_regex)
-            and wo["priCode"] == "800 PREVENTIVE"
-        ]
-        fake_pms = [
-            wo
-            for wo in self.new_workorders
-            if has_keyword_regex(wo, CONFIG.cancel_regex) and wo not in real_pms
-        ]
-        logger.debug("parsing stale...")
-        stale_workorders = [
-            wo
-            for wo in get_workorders("17 Elec HOLD")
-            if datetime.today().astimezone() - datetime.fromisoformat(wo["entDate"])
-            > timedelta(365)
-        ]
-        logger.debug("parsing urgent...")
-        urgent = [
-            wo
-            for wo in self.new_workorders
-            if datetime.fromisoformat(wo["entDate"]).astimezone() >= self.last_run
-            and wo["priCode"] in URGENT
-            and wo not in fake_pms
-        ]
+        logger.debug(f"{self.__class__}: fetching {sorted(due)}, last_run {self.last_run}")
+        s = new_session()
+        authenticate(s)
+        plans = list()
+        fetched = dict()
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            if "new" in due:
+                new = pool.submit(get_workorders, CONFIG.queries["new"], s, True)
+            if "hold" in due:
+                hold = pool.submit(self._triage_hold, s)
+            if "active" in due:
+                active = pool.submit(self._fetch_active, s)
+            if "new" in due:
+                self.new_workorders = fetched["new"] = new.result()
+            if "active" in due:
+                self.active_workorders, assignments = active.result()
+                logger.debug("joining assignments")
+                join_assignments(self.active_workorders, assignments)
+                fetched["active"] = self.active_workorders
+            if "hold" in due:
+                plans.append(hold.result())
+        logger.debug(f"fetched, {RESPONSES}")
+
+        changes = WorklistDiff()
+        for source, workorders in fetched.items():
+            diff = self.changes[source].update(workorders)
+            logger.debug(f"{source}: {diff}")
+            changes.update(diff)
+            if not self.triage.needs_all_rows(source):
+                # unchanged records would be planned the same as last time
+                workorders = diff.changed.values()
+            plans.append(self.triage.plan({source: workorders}, self.last_run[source]))
+        if changes:
+            self.worklist_changed.emit(changes)
+
+        logger.debug("triage...")
+        plan = merge_plans(*plans)
+        urgent = plan.pop(JobAction.NOTIFY, dict())
         logger.debug("Found:")
-        logger.debug(f"{len(fake_pms)} fake pm's")
-        logger.debug(f"{len(real_pms)} reals pm's")
-        logger.debug(f"{len(pastdue)} past due workorders")
-        logger.debug(f"{len(stale_workorders)} stale workorders")
+        for action, workorders in plan.items():
+            logger.debug(f"{len(workorders)} to {action.name}")
         logger.debug(f"{len(urgent)} urgent workorders")
 
-        cancel = fake_pms + stale_workorders
-
-        # Make job lists
-        hold = [make_job(wo, JobAction.HOLD) for wo in real_pms]
-        cancel = [make_job(wo, JobAction.CANCEL) for wo in cancel]
-        de_escalate = [make_job(wo, JobAction.DE_ESCALATE) for wo in pastdue]
-
-        jobs = hold + cancel + de_escalate
+        # Make job lists, leaving out work already done or given up on
+        skip = self.store.journaled() | {r["key"] for r in self.store.failed()}
+        jobs = [
+            make_job(wo, action)
+            for action, workorders in plan.items()
+            for key, wo in workorders.items()
+            if (action.name, *key) not in skip
+        ]
 
         # emit signals
         if jobs:
             logger.debug(f"{len(jobs)} new jobs found")
             self.new_jobs.emit(jobs)
-        if urgent:
-            notify_17E_urgent(urgent)
+        if urgent or "new" in due:
+            # even when empty, so a new outbox learns what is already open
+            self.new_urgent.emit(list(urgent.values()))
 
-        self.last_run = datetime.now().astimezone()
+        for source in due:
+            self.last_run[source] = started
+
+    def _fetch_active(self, s) -> tuple[list[Workorder], list[dict]]:
+        """Fetch active work, then its shop assignments as soon as it arrives"""
+        active = get_workorders(CONFIG.queries["active"], s, True)
+        logger.debug("fetching assignments")
+        return active, get_shop_assignments(active, s, True)
+
+    def _triage_hold(self, s) -> JobPlan:
+        """Triage HOLD work page by page as it streams in, keeping only matches"""
+        return self.triage.plan(
+            {"hold": iter_workorders(CONFIG.queries["hold"], s, True)},
+            self.last_run["hold"],
+        )
 
 
 class AimDaemon(QObject):
 
     def __init__(self, parent: QObject = None) -> None:
         super().__init__(parent)
-        self.processor = AimProcessor()
-        self.fetcher = AimFetcher()
+        self.store = JobStore()
+        self.processor = AimProcessor(self.store)
+        self.fetcher = AimFetcher(self.store)
+        self.notifier = NtfyDispatcher()
+        self.schedule = RefreshScheduler(self)
         self.timer = QTimer()
-
-        self.timer.timeout.connect(self.fetcher.fetch)
-        self.fetcher.new_urgent.connect(notify_17E_urgent)
+        self.reap_timer = QTimer()
+
+        self.schedule.due.connect(self.fetcher.fetch)
+        # urgent work whose announcement failed is only in the outbox now
+        self.timer.timeout.connect(self.notifier.resume)
+        self.reap_timer.timeout.connect(self.processor.reap_sessions)
+        self.fetcher.new_urgent.connect(self.notifier.notify)
+        self.fetcher.worklist_changed.connect(self.prune_outbox)
         self.fetcher.new_jobs.connect(self.processor.add_jobs)
 
     @Slot()
     def start(self):
         logger.debug("starting daemon")
+        self.schedule.start()
         self.timer.start(CONFIG.refresh)
+        self.reap_timer.start(60 * 1000)
+        self.store.prune(CONFIG.journal_days)
+        self.processor.resume()
+        self.notifier.resume()
         self.fetcher.fetch()
 
     @Slot()
-    def update(self):
-        self.timer.setInterval(CONFIG.refresh)
+    def stop(self):
+        logger.debug("stopping daemon")
+        self.schedule.stop()
+        self.timer.stop()
+        self.reap_timer.stop()
+        self.processor.shutdown()
+        self.notifier.close()
+        self.store.close()
+
+    @Slot(str)
+    def update(self, key: str):
+        if key == "refresh":
+            self.timer.setInterval(CONFIG.refresh)
+
+    @Slot(object)
+    def prune_outbox(self, changes: WorklistDiff) -> None:
+        if not changes.removed or not self.fetcher.new_workorders:
+            return
+        open_keys = {w.key for w in self.fetcher.new_workorders}
+        self.notifier.outbox.prune(CONFIG.journal_days, open_keys)
 
     @Slot(list)
     def create_daily_assignments(self, people: List[str]) -> None:
         msg = "Creating assignments: {}"
         jobs = []
         for person in people:
-            jobs.append(Job(make_daily_assignment, person, msg.format(person)))
+            jobs.append(
+                Job(
+                    make_daily_assignment,
+                    person,
+                    msg.format(person),
+                    priority=JobPriority.USER,
+                    key=(make_daily_assignment.__name__, person),
+                    retryable=False,
+                )
+            )
         self.processor.add_jobs(jobs)
 
     @Slot(dict)
     def create_workorder(self, workorder: Workorder) -> None:
         self.processor.add_job(
-            Job(create_workorder, workorder, "Creating new workorder")
+            Job(
+                create_workorder,
+                workorder,
+                "Creating new workorder",
+                priority=JobPriority.INTERACTIVE,
+                retryable=False,
+            )
         )
 
     @Slot()
     def guess_hrcs(self) -> None:
         workorders = []
-        for w in self.fetcher.active_workorders:
-            if has_no_hrc(w):
-                w["HRC"] = guess_hrc(w)
-                workorders.append(w)
-        self.processor.add_jobs([make_job(w, JobAction.ADD_HRC) for w in workorders])
+        for w, code in classify(self.fetcher.active_workorders):
+            w["HRC"] = code
+            workorders.append(w)
+        self.processor.add_jobs(
+            [make_job(w, JobAction.ADD_HRC, JobPriority.USER) for w in workorders]
+        )
 
     @Slot()
     def fix_primary_assignments(self) -> None:
         workorders = [w for w in self.fetcher.active_workorders if w["shopPerson"]]
-        self.processor.add_jobs([make_job(w, JobAction.ASSIGN) for w in workorders])
+        self.processor.add_jobs(
+            [make_job(w, JobAction.ASSIGN, JobPriority.USER) for w in workorders]
+        )
 
     @Slot(dict)
     def assign_workorder(self, workorder: Workorder) -> None:
@@ -356,34 +758,37 @@ class AimDaemon(QObject):
         pass
 
 
-def notify_17E_urgent(
-    workorders: List[Workorder], ntfy_url: str = CONFIG.ntfy_url
-) -> None:
-    logger.debug("notify")
-    msg = ""
-    for wo in workorders:
-        url = AIM_URL_TEMPLATE.format(wo["proposal"], wo["sortCode"])
-        if CONFIG.ntfy_include_href:
-            msg += f"[{wo['proposal']} {wo['sortCode']}]({url}) :\n {wo['description']}\n\n"
-        else:
-            msg += f"{wo['proposal']} {wo['sortCode']}:\n {wo['description']}\n\n"
-        requests.post(
-            ntfy_url,
-            data=msg.encode(encoding="utf-8"),
-            headers={"Title": "New urgent work request(s)", "Markdown": "yes"},
-        )
+def _saved(saved: bool, what: str, workorder: Workorder) -> None:
+    """Fail the job if the session could not save the change, so it is not journaled"""
+    if not saved:
+        raise NotSavedError(f"could not {what} {workorder['proposal']}-{workorder['sortCode']}")
 
 
 def cancel_workorder(aim: AimSession, workorder: Workorder) -> None:
-    aim.change_status(workorder["proposal"], workorder["sortCode"], "CANCEL")
+    saved = aim.change_status(workorder["proposal"], workorder["sortCode"], "CANCEL")
+    _saved(saved, "cancel", workorder)
 
 
 def hold_workorder(aim: AimSession, workorder: Workorder) -> None:
-    aim.change_status(workorder["proposal"], workorder["sortCode"], "HOLD")
+    saved = aim.change_status(workorder["proposal"], workorder["sortCode"], "HOLD")
+    _saved(saved, "hold", workorder)
 
 
 def de_escalate_workorder(aim: AimSession, workorder: Workorder) -> None:
-    aim.deprioritize(workorder["proposal"], workorder["sortCode"])
+    saved = aim.deprioritize(workorder["proposal"], workorder["sortCode"])
+    _saved(saved, "de-escalate", workorder)
+
+
+def cancel_workorder_http(api: PhaseApi, workorder: Workorder) -> bool:
+    return api.change_status(workorder["proposal"], workorder["sortCode"], "CANCEL")
+
+
+def hold_workorder_http(api: PhaseApi, workorder: Workorder) -> bool:
+    return api.change_status(workorder["proposal"], workorder["sortCode"], "HOLD")
+
+
+def de_escalate_workorder_http(api: PhaseApi, workorder: Workorder) -> bool:
+    return api.deprioritize(workorder["proposal"], workorder["sortCode"])
 
 
 def create_workorder(aim: AimSession, workorder: Workorder) -> None:
@@ -400,24 +805,34 @@ def make_daily_assignment(aim: AimSession, person: str) -> None:
 
 
 def add_hrc(aim: AimSession, workorder: Workorder):
-    aim.add_hrc(
+    saved = aim.add_hrc(
         workorder=workorder["proposal"],
         phase=workorder["sortCode"],
         hrc=workorder["HRC"],
     )
+    _saved(saved, "add an HRC to", workorder)
+
+
+def add_hrc_http(api: PhaseApi, workorder: Workorder) -> bool:
+    return api.add_hrc(workorder["proposal"], workorder["sortCode"], workorder["HRC"])
 
 
 def assign_workorder(aim: AimSession, workorder: Workorder):
-    aim.reassign(
+    saved = aim.reassign(
         workorder=workorder["proposal"],
         phase=workorder["sortCode"],
         shop=CONFIG.shop,
         person=workorder["shopPerson"],
     )
+    _saved(saved, "assign", workorder)
     aim.update_daily_assignment(name=workorder["shopPerson"], wo=workorder["proposal"])
 
 
-def make_job(workorder: Workorder, action: JobAction) -> Job:
+def make_job(
+    workorder: Workorder,
+    action: JobAction,
+    priority: JobPriority = JobPriority.BACKGROUND,
+) -> Job:
     ACTIONS = {
         JobAction.CANCEL: cancel_workorder,
         JobAction.HOLD: hold_workorder,
@@ -425,10 +840,38 @@ def make_job(workorder: Workorder, action: JobAction) -> Job:
         JobAction.ADD_HRC: add_hrc,
         JobAction.ASSIGN: assign_workorder,
     }
+    HTTP_ACTIONS = {
+        JobAction.CANCEL: cancel_workorder_http,
+        JobAction.HOLD: hold_workorder_http,
+        JobAction.DE_ESCALATE: de_escalate_workorder_http,
+        JobAction.ADD_HRC: add_hrc_http,
+    }
     if action not in ACTIONS:
         raise ValueError(f"{action} is not a valid action")
     return Job(
         ACTIONS[action],
         workorder,
         f"{workorder['proposal']} -- {workorder['sortCode']}",
+        HTTP_ACTIONS.get(action),
+        priority,
+        (action.name, *workorder.key),
+    )
+
+
+# name -> job function, to rebuild jobs from the JobStore
+JOB_FUNCTIONS = {
+    f.__name__: f
+    for f in (
+        cancel_workorder,
+        hold_workorder,
+        de_escalate_workorder,
+        cancel_workorder_http,
+        hold_workorder_http,
+        de_escalate_workorder_http,
+        create_workorder,
+        make_daily_assignment,
+        add_hrc,
+        add_hrc_http,
+        assign_workorder,
     )
+}
@@ -1,24 +1,30 @@
 from __future__ import annotations
 
 import os
-import re
 import sys
 import time
 import keyring
 import logging
 
 from datetime import datetime
+from functools import wraps
+from typing import Callable
 from selenium import webdriver
 from selenium.common.exceptions import (
     NoSuchElementException,
     WebDriverException,
     SessionNotCreatedException,
+    TimeoutException,
 )
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
 # from selenium.webdriver.chrome.service import Service
 from PySide6.QtCore import QObject, Signal
 
+from .cookie_store import load_cookies, store_cookies
+from .hrc import guess_hrc
 from .settings import CONFIG
 
 if sys.platform == "win32":
@@ -36,12 +42,20 @@ logger = logging.getLogger(__name__)
 if CONFIG.debug:
     logger.setLevel(logging.DEBUG)
 
-DELAY = 0.5
+DEBUG_PORT = 9222
+
+# Wait timeouts, in seconds
+POLL = 0.1
+STEP_TIMEOUT = 10
+MODAL_TIMEOUT = 1
+PAGE_TIMEOUT = 30
+LOGIN_TIMEOUT = 120
 
 TESTING = True
 
 # URLS
-AIM_BASE = "https://washington.assetworks.hosting/fmax/screen/"
+AIM_HOST = "https://washington.assetworks.hosting/"
+AIM_BASE = AIM_HOST + "fmax/screen/"
 AIM_TRAINING = "https://cmms-train.admin.washington.edu/fmax/screen/"
 HOME_PAGE = AIM_BASE + "WORKDESK"
 AIM_TIMECARD = AIM_BASE + "TIMECARD_VIEW"
@@ -149,11 +163,31 @@ WD_CHECKOUT = "wd-DropDownCommandButton-56$234381"
 WD_CHECKIN_OK = "abd0c5e699434850b098af4349f3ca7f"
 WD_CHECKOUT_OK = "18d0d13631c747b994d882c58ad8275f"
 
+MODAL = "Modal Message"
+
 
 class AimErrorException(Exception):
     pass
 
 
+class NotSavedError(AimErrorException):
+    "AiM did not confirm a change, which may go through on another attempt"
+
+
+def timed(func: Callable) -> Callable:
+    "Log how long a session action takes"
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            logger.debug(f"{func.__name__} took {time.perf_counter() - start:.2f}s")
+
+    return wrapper
+
+
 class AimSession(QObject):
     """
     Wrapper class for a selenium webdriver object, tailored to
@@ -163,21 +197,31 @@ class AimSession(QObject):
     message = Signal(str)
     progress = Signal(int, int)
 
-    def __init__(self, *, netid="", debug=TESTING):
+    def __init__(self, *, netid="", debug=TESTING, profile="", port=DEBUG_PORT):
+        """
+        :param netid: string -> UW NetID used to log in
+        :param debug: bool -> show the browser window
+        :param profile: string -> browser profile directory, defaults to CONFIG.chrome_profile
+        :param port: int -> remote debugging port, must be unique per running browser
+        """
         super().__init__()
         if not netid:
             raise ValueError("netid must be provided")
+        profile = profile or CONFIG.chrome_profile
         opt = Options()
         opt.headless = not debug
-        opt.add_argument("--remote-debugging-port=9222")
+        opt.add_argument(f"--remote-debugging-port={port}")
         if CONFIG.chrome_exe:
             opt.binary_location = CONFIG.chrome_exe
-        if CONFIG.chrome_profile:
-            opt.add_argument(f"user-data-dir={CONFIG.chrome_profile}")
+        if profile:
+            opt.add_argument(f"user-data-dir={profile}")
         opt.add_experimental_option("excludeSwitches", ["enable-logging"])
 
         self.debug = debug
         self.netid = netid
+        self.profile = profile
+        self.port = port
+        self._fresh = True
         driver_path = CONFIG.chrome_driver or None
         service = Service(driver_path)
         if CREATE_NO_WINDOW:
@@ -188,7 +232,8 @@ class AimSession(QObject):
             service=service,
             options=opt,
         )
-        self.driver.implicitly_wait(20)
+        # every lookup states its own timeout, see probe() and require()
+        self.driver.implicitly_wait(0)
         logger.info("Init complete.")
 
     def __enter__(self):
@@ -196,46 +241,143 @@ class AimSession(QObject):
         return self
 
     def __exit__(self, ex_type, ex_val, ex_trace):
-        self.driver.quit()
+        self.quit()
         return True
 
     def __getattr__(self, name):
         return getattr(self.driver, name)
 
+    def quit(self) -> None:
+        "Shut down the webdriver, ignoring errors from an already dead browser"
+        try:
+            self.driver.quit()
+        except Exception:
+            # a dead chromedriver raises urllib3 errors, not WebDriverException
+            pass
+
+    def _wait(self, timeout: float) -> WebDriverWait:
+        return WebDriverWait(self.driver, timeout, poll_frequency=POLL)
+
+    def _require(self, locators, timeout, clickable=False):
+        condition = (
+            EC.element_to_be_clickable if clickable else EC.presence_of_element_located
+        )
+        try:
+            return self._wait(timeout).until(
+                EC.any_of(*(condition(locator) for locator in locators))
+            )
+        except TimeoutException:
+            raise NoSuchElementException(
+                f"{' or '.join(item for _, item in locators)} not found after {timeout}s"
+            )
+
+    def require(self, item, timeout=STEP_TIMEOUT, by=By.ID, clickable=False):
+        """
+        Wait for an element that must be on the page, and return it
+        :param clickable: bool -> also wait for the element to be visible and enabled
+        :raises NoSuchElementException: if the element does not show up in time
+        """
+        return self._require([(by, item)], timeout, clickable)
+
+    def probe(self, item, by=By.ID, timeout=0):
+        """
+        Look for an element that may legitimately be missing
+        :param timeout: seconds to keep looking, defaults to a single lookup
+        :return: the element, or None
+        """
+        if timeout:
+            try:
+                return self.require(item, timeout, by)
+            except NoSuchElementException:
+                return None
+        found = self.driver.find_elements(by, item)
+        return found[0] if found else None
+
+    def wait_for_modal(self, timeout=STEP_TIMEOUT) -> bool:
+        "Wait for a modal dialog to open. Returns False if none appears in time"
+        try:
+            self._wait(timeout).until(EC.title_contains(MODAL))
+        except TimeoutException:
+            return False
+        return True
+
+    def wait_modal_cleared(self, timeout=STEP_TIMEOUT) -> None:
+        self._wait(timeout).until_not(EC.title_contains(MODAL))
+
+    def wait_for_url_change(self, url: str, timeout=PAGE_TIMEOUT) -> None:
+        self._wait(timeout).until(EC.url_changes(url))
+
+    def wait_for_reload(self, element, timeout=PAGE_TIMEOUT) -> None:
+        "Wait until the page holding element has been replaced"
+        self._wait(timeout).until(EC.staleness_of(element))
+
+    @timed
     def login(self):
-        "Login to AiM."
+        "Login to AiM. Stored cookies are tried before the SSO form."
+        if self._fresh:
+            # only a new browser gets the stored cookies, so they never
+            # overwrite newer ones from a live session
+            self._fresh = False
+            self._inject_cookies()
         self.driver.get(HOME_PAGE)
-        time.sleep(0.1)
-        if AIM_BASE not in self.driver.current_url:
-            time.sleep(DELAY)
-            logger.info("Logging in...")
-            password = keyring.get_password("aim", self.netid)
-            # clear login fields, in case autofill is enabled
-            # for some reason, clear() doesn't work
-            self.send_keys_to(UID, [Keys.BACKSPACE] * 1000)
-            self.send_keys_to(PWD, [Keys.BACKSPACE] * 1000)
-            self.send_keys_to(UID, self.netid)
-            self.send_keys_to(PWD, password)
-            time.sleep(DELAY)
-            self.send_keys_to(PWD, Keys.ENTER)
-            while AIM_BASE not in self.driver.current_url:
-                time.sleep(DELAY)
-                if "Is this your device?" in self.driver.page_source:
-                    self.click(TRUST)
-            logger.info("login complete.")
-
-    def click(self, item):
-        try:
-            self.driver.find_element(By.ID, item).click()
-        except NoSuchElementException:
-            self.driver.find_elements(By.CLASS_NAME, item).click()
+        if AIM_BASE in self.driver.current_url:
+            return
+        logger.info("Logging in...")
+        password = keyring.get_password("aim", self.netid)
+        # clear login fields, in case autofill is enabled
+        # for some reason, clear() doesn't work
+        self._select_and_delete(UID)
+        self._select_and_delete(PWD)
+        self.send_keys_to(UID, self.netid)
+        self.send_keys_to(PWD, password)
+        login_url = self.driver.current_url
+        self.send_keys_to(PWD, Keys.ENTER)
+        self.wait_for_url_change(login_url, LOGIN_TIMEOUT)
+        self._wait(LOGIN_TIMEOUT).until(self._login_finished)
+        store_cookies({c["name"]: c["value"] for c in self.driver.get_cookies()})
+        logger.info("login complete.")
+
+    def _inject_cookies(self) -> None:
+        cookies = load_cookies()
+        for name, value in cookies.items():
+            # CDP lets us set cookies before any AiM page has been loaded
+            self.driver.execute_cdp_cmd(
+                "Network.setCookie", {"name": name, "value": value, "url": AIM_HOST}
+            )
+        logger.debug(f"injected {len(cookies)} stored cookies")
+
+    def _select_and_delete(self, element_id) -> None:
+        self.send_keys_to(element_id, [Keys.CONTROL, "a"])
+        self.send_keys_to(element_id, Keys.DELETE)
+
+    def _login_finished(self, driver) -> bool:
+        if AIM_BASE in driver.current_url:
+            return True
+        if "Is this your device?" in driver.page_source:
+            self.click(TRUST)
+        return False
+
+    def click(self, item, timeout=STEP_TIMEOUT, by=By.ID, reload=False):
+        """
+        Click an element once it is clickable. An element ID that isn't found
+        is also tried as a class name, within the same timeout.
+        :param reload: bool -> also wait for the click to replace the page
+        """
+        locators = [(by, item)]
+        if by == By.ID:
+            locators.append((By.CLASS_NAME, item))
+        element = self._require(locators, timeout, clickable=True)
+        element.click()
+        if reload:
+            self.wait_for_reload(element)
 
     def clear(self, element_id):
-        self.driver.find_element(By.ID, element_id).clear()
+        self.require(element_id).clear()
 
     def send_keys_to(self, element_id, keys):
-        self.driver.find_element(By.ID, element_id).send_keys(keys)
+        self.require(element_id).send_keys(keys)
 
+    @timed
     def deprioritize(
         self, workorder: str, phase: str, priority: str = "500 SCHEDULED"
     ) -> bool:
@@ -251,10 +393,12 @@ class AimSession(QObject):
             self.clear(PH_PRIORITY)
             self.send_keys_to(PH_PRIORITY, priority)
             self.click(SAVE)
+            self.require(PH_V_STATUS)
             return True
-        except NoSuchElementException:
+        except (NoSuchElementException, TimeoutException):
             return False
 
+    @timed
     def change_status(self, workorder: str, phase: str, status: str) -> bool:
         """
         Change the status of a workorder phase
@@ -271,11 +415,11 @@ class AimSession(QObject):
                 self.clear(PH_PRIORITY)
                 self.send_keys_to(PH_PRIORITY, "500 SCHEDULED")
             self.click(SAVE)
-            time.sleep(DELAY)
-        except NoSuchElementException:
+        except (NoSuchElementException, TimeoutException):
             pass
-        return self.driver.find_element(By.ID, PH_V_STATUS).text == status
+        return self.require(PH_V_STATUS).text == status
 
+    @timed
     def add_extra_description(self, workorder: str, phase: str, extra: str) -> bool:
         """
         Add extra description to workorder phase
@@ -287,15 +431,13 @@ class AimSession(QObject):
         try:
             self.click(EDIT)
             self.click(PH_EX_DESC_OPEN)
-            time.sleep(DELAY)
-            extra = self.driver.find_element_by_id(PH_EX_DESC_ENTRY).text + extra
+            extra = self.require(PH_EX_DESC_ENTRY).text + extra
             self.clear(PH_EX_DESC_ENTRY)
             self.send_keys_to(PH_EX_DESC_ENTRY, extra)
-            self.click(DONE)
-            time.sleep(DELAY)
+            self.click(DONE, reload=True)
             self.click(SAVE)
-            time.sleep(DELAY)
-        except NoSuchElementException:
+            self.require(PH_V_STATUS)
+        except (NoSuchElementException, TimeoutException):
             return False
         return True
 
@@ -306,7 +448,7 @@ class AimSession(QObject):
         self.send_keys_to(PH_WORK_CODE_GRP, "ELECTRICAL")
 
     def _add_hrc(self, hrc: str) -> None:
-        desc = self.driver.find_element(By.ID, PH_DESC).text
+        desc = self.require(PH_DESC).text
         if len(desc) > 198:
             desc = desc[:-8]
         desc += "\n" + hrc
@@ -314,17 +456,9 @@ class AimSession(QObject):
         self.send_keys_to(PH_DESC, desc)
 
     def _guess_hrc(self):
-        txt = self.driver.find_element(By.ID, PH_DESC_V).text
-        if re.search("\\b(lab|fume(hood)?)\\b", txt, re.IGNORECASE | re.MULTILINE):
-            return "HRC107"
-        if re.search("\\b(light(s)?)\\b", txt, re.IGNORECASE | re.MULTILINE):
-            return "HRC117"
-        if re.search("\bb(roof(top)?)\bb", txt, re.IGNORECASE | re.MULTILINE):
-            return "HRC109"
-        if re.search("lift station", txt, re.IGNORECASE | re.MULTILINE):
-            return "HRC113"
-        return "HRC110"
+        return "HRC" + guess_hrc(self.require(PH_DESC_V).text)
 
+    @timed
     def add_hrc(self, workorder: str, phase: str, hrc: str = "") -> bool:
         self.get(PHASE_VIEW.format(workorder, phase))
         if not hrc:
@@ -335,24 +469,26 @@ class AimSession(QObject):
             self.click(EDIT)
             self._add_hrc(hrc)
             self.click(SAVE)
-            time.sleep(DELAY)
+            self.require(PH_V_STATUS)
         except Exception:
             self.click(CANCEL)
             return False
         return True
 
+    @timed
     def change_code(self, workorder: str, phase: str, code: str) -> bool:
         self.get(PHASE_VIEW.format(workorder, phase))
         try:
             self.click(EDIT)
             self._change_code(code)
             self.click(SAVE)
-            time.sleep(DELAY)
+            self.require(PH_V_STATUS)
         except Exception:
             self.click(CANCEL)
             return False
         return True
 
+    @timed
     def new_workorder(
         self,
         prop: str,
@@ -385,28 +521,23 @@ class AimSession(QObject):
         self.send_keys_to(WO_DESC, desc)
         self.send_keys_to(WO_PROPERTY, prop)
         self.click(WO_PROP_ZOOM)
-        time.sleep(DELAY)
         self.progress.emit(self.__completed, self.__steps)
         self.__completed += 1
         self.message.emit("Setting up account...")
         # Account setup
-        self.find_element(By.ID, ACCT_SETUP).click()
-        time.sleep(1)
-        self.find_element(By.ID, ACCT_ADD).click()
-        time.sleep(1)
-        self.find_element(By.ID, ACCT_NEXT).click()
-        self.find_element(By.ID, ACCT_ID).send_keys("ABSORBED")
-        self.find_element(By.ID, ACCT_SUB).send_keys("NONE")
-        self.find_element(By.ID, ACCT_PERCENT).send_keys("100")
-        self.find_element(By.ID, DONE).click()
-        time.sleep(1)
-        self.find_element(By.ID, DONE).click()
+        self.click(ACCT_SETUP)
+        self.click(ACCT_ADD)
+        self.click(ACCT_NEXT)
+        self.send_keys_to(ACCT_ID, "ABSORBED")
+        self.send_keys_to(ACCT_SUB, "NONE")
+        self.send_keys_to(ACCT_PERCENT, "100")
+        self.click(DONE, reload=True)
+        self.click(DONE, reload=True)
         # Setup first phase
         self.progress.emit(self.__completed, self.__steps)
         self.__completed += 1
         self.message.emit("Adding first phase...")
         self.click(WO_ADD_PHASE)
-        time.sleep(1)
         self.send_keys_to(PH_SHOP, "17 ELECTRICAL")
         self.send_keys_to(PH_WORK_CODE, "ELECTRICAL")
         self.send_keys_to(PH_WORK_CODE_GRP, "ELECTRICAL")
@@ -417,24 +548,24 @@ class AimSession(QObject):
             self.__completed += 1
             self.send_keys_to(PH_PRIMARY, CONFIG.shop_people[primary])
             self.click(PH_PRI_ZOOM)
-            time.sleep(0.1)
+            self.require(PH_STATUS, clickable=True)
             self.clear(PH_STATUS)
             self.send_keys_to(PH_STATUS, "ACTIVE")
-        time.sleep(DELAY)
-        self.click(DONE)
+        self.click(DONE, reload=True)
         self.progress.emit(self.__completed, self.__steps)
         self.message.emit("Done.")
-        time.sleep(DELAY)
-        self.click(SAVE)
-        time.sleep(DELAY)
-        error = self.find_element(By.ID, WO_ERRORS).text
-        if error:
+        self.click(SAVE, reload=True)
+        # the saved workorder view on success, the edit page with a message otherwise
+        self._require([(By.ID, WO_NUMBER), (By.ID, WO_ERRORS)], PAGE_TIMEOUT)
+        error = self.probe(WO_ERRORS)
+        if error is not None and error.text:
             self.click(CANCEL)
-            time.sleep(DELAY)
+            self.wait_for_modal()
             self.click(YES)
             raise AimErrorException("Could not create workorder")
-        self.message.emit(self.find_element(By.ID, WO_NUMBER).text)
+        self.message.emit(self.require(WO_NUMBER).text)
 
+    @timed
     def reassign(
         self,
         workorder: str,
@@ -447,33 +578,30 @@ class AimSession(QObject):
         if not shop:
             shop = "17 MAINTENANCE ELECTRICAL"
         self.get(PHASE_VIEW.format(workorder, phase))
-        self.click(EDIT)
-        time.sleep(0.1)
-        if "Modal Message" in self.driver.title:
+        self.click(EDIT, reload=True)
+        if MODAL in self.driver.title:
             return False
-        time.sleep(DELAY)
         try:
             self.click(PH_SELECT_SHOP_PEOPLE)
             self.click(PH_REMOVE_SHOP_PEOPLE)
-            time.sleep(0.25)
-            if "Modal Message" in self.driver.title:
+            if self.wait_for_modal(MODAL_TIMEOUT):
                 self.click(YES)
-                time.sleep(0.25)
+                self.wait_modal_cleared()
             try:
                 self.clear(PH_SHOP)
                 self.send_keys_to(PH_SHOP, shop)
             except WebDriverException:
                 pass
             if person:
-                self.click(PH_LOAD_SHOP_PEOPLE)
+                self.click(PH_LOAD_SHOP_PEOPLE, reload=True)
                 # Look for the Checkbox associated with the desired person
+                self.require("browseRow", by=By.CLASS_NAME)
                 for element in self.find_elements(By.CLASS_NAME, "browseRow"):
                     if person in element.text:
                         element.find_element(By.TAG_NAME, "input").click()
                         break
-                self.click(DONE)
-                time.sleep(0.25)
-                self.find_element(By.XPATH, PH_SHOP_PERSON_PRIMARY_YN).click()
+                self.click(DONE, reload=True)
+                self.click(PH_SHOP_PERSON_PRIMARY_YN, by=By.XPATH)
             if code:
                 self._change_code(code)
             self.click(SAVE)
@@ -483,6 +611,7 @@ class AimSession(QObject):
             print(e)
             return False
 
+    @timed
     def make_daily_assignment(self, person: str, date: str = "") -> None:
         logger.debug(f"Creating Daily Assignment for {person}")
         self.__completed = 0
@@ -495,16 +624,15 @@ class AimSession(QObject):
         self.get(DAILY_ASSIGNMENTS)
         if not date:
             date = datetime.today().strftime("%b %d, %Y")
-        time.sleep(DELAY)
         self.click(NEW)
         logger.debug(date)
-        time.sleep(DELAY)
 
         self.send_keys_to(DA_DATE, date)
         self.send_keys_to(DA_SHOP_PERSON, id)
 
         self._edit_daily_assignment(person)
 
+    @timed
     def update_daily_assignment(self, name, wo=""):
         self.get(DA_BROWSE.format(name))
         self.click(DA_BROWSE_LATEST)
@@ -515,41 +643,37 @@ class AimSession(QObject):
         logger.debug(f"editing assignment for {name}")
 
         try:
-            self.click(DA_LOAD_WORKORDERS)
-            time.sleep(0.1)
+            self.click(DA_LOAD_WORKORDERS, reload=True)
             self.click(DA_OVERHEAD)
-            self.click(EXECUTE)
-            time.sleep(0.1)
+            self.click(EXECUTE, reload=True)
             self.click(SELECT_ALL)
-            time.sleep(0.1)
-            self.click(DONE)
+            self.click(DONE, reload=True)
             self.progress.emit(self.__completed, self.__steps)
             self.__completed += 1
-            self.click(DA_LOAD_PREVIOUS)
-            time.sleep(0.1)
+            self.click(DA_LOAD_PREVIOUS, reload=True)
             self.progress.emit(self.__completed, self.__steps)
             self.__completed += 1
-            self.click(DA_LOAD_WORKORDERS)
-            time.sleep(0.1)
+            self.click(DA_LOAD_WORKORDERS, reload=True)
             self.progress.emit(self.__completed, self.__steps)
             self.__completed += 1
             if wo:
                 self.send_keys_to(DA_SEARCH_WO, wo)
             else:
+                self.require("viewMenuLink", by=By.CLASS_NAME)
                 for query in self.find_elements(By.CLASS_NAME, "viewMenuLink"):
                     if name in query.text:
                         query.click()
                         break
-            self.click(EXECUTE)
+            self.click(EXECUTE, reload=True)
             self.click(SELECT_ALL)
-            self.click(DONE)
+            self.click(DONE, reload=True)
             self.click(SAVE)
-            time.sleep(0.1)
+            self.wait_for_modal()
             self.click(YES)
             self.progress.emit(self.__completed, self.__steps)
-        except NoSuchElementException:
+        except (NoSuchElementException, TimeoutException):
             self.click(CANCEL)
-            time.sleep(DELAY)
+            self.wait_for_modal()
             self.click(YES)
             raise AimErrorException("Record already exists")
 
@@ -39,6 +39,7 @@ from PySide6.QtWidgets import (
 )
 
 from .settings import CONFIG, RESOURCES
+from .schedule import DEFAULT_INTERVAL
 from .aim_daemon import AimDaemon
 
 
@@ -307,7 +308,9 @@ class SettingsPane(QWidget):
         super().__init__(parent)
         self.netid = QLineEdit()
         self.change_password_button = QPushButton("Change Password")
-        self.refresh_time = QSpinBox()
+        # seconds between fetches, per query
+        self.intervals = {source: QSpinBox() for source in CONFIG.queries}
+        self.workers = QSpinBox()
         self.ntfy_url = QLineEdit()
         self.ntfy_include_href = QCheckBox("href")
         self.chrome_path = QLineEdit()
@@ -321,7 +324,12 @@ class SettingsPane(QWidget):
         self._advanced = (5, 6, 7)
 
         # Prefill existing config
-        self.refresh_time.setValue(int(CONFIG.refresh / 60000))
+        for source, interval in self.intervals.items():
+            schedule = CONFIG.schedules.get(source, dict())
+            interval.setRange(1, 7 * 24 * 60 * 60)
+            interval.setValue(int(schedule.get("interval", DEFAULT_INTERVAL)))
+        self.workers.setRange(1, 8)
+        self.workers.setValue(CONFIG.workers)
         self.netid.setText(CONFIG.netid)
         self.ntfy_url.setText(CONFIG.ntfy_url)
         self.ntfy_include_href.setChecked(CONFIG.ntfy_include_href)
@@ -331,7 +339,9 @@ class SettingsPane(QWidget):
         self.debug.setChecked(CONFIG.debug)
 
         # set tool tips
-        self.refresh_time.setToolTip("Time in minuites")
+        for source, interval in self.intervals.items():
+            interval.setToolTip(f"Seconds between fetches of {CONFIG.queries[source]}")
+        self.workers.setToolTip("Number of browsers used to process jobs in parallel")
         self.ntfy_include_href.setToolTip("Include AiM link in ntfy notification")
         self.debug.setToolTip("Display chromedriver window")
         # Connect sgnals
@@ -373,7 +383,9 @@ class SettingsPane(QWidget):
 
         scroll_layout = QFormLayout()
         scroll_layout.addRow("NetID", netid_box)
-        scroll_layout.addRow("Refresh", self.refresh_time)
+        for source, interval in self.intervals.items():
+            scroll_layout.addRow(f"Refresh {source}", interval)
+        scroll_layout.addRow("Browsers", self.workers)
         scroll_layout.addRow("ntfy url", ntfy_box)
         scroll_layout.addRow("Chrome Profile", chrome_profile_box)
         scroll_layout.addRow("Chrome exe", chrome_box)
@@ -431,7 +443,11 @@ class SettingsPane(QWidget):
         data["chrome_exe"] = self.chrome_path.text()
         data["chrome_driver"] = self.chromedriver_path.text()
         data["chrome_profile"] = self.chrome_profile.text()
-        data["refresh"] = self.refresh_time.value() * 60000
+        schedules = {k: dict(v) for k, v in CONFIG.schedules.items()}
+        for source, interval in self.intervals.items():
+            schedules.setdefault(source, dict())["interval"] = interval.value()
+        data["schedules"] = schedules
+        data["workers"] = self.workers.value()
         data["debug"] = self.debug.isChecked()
         data["ntfy_include_href"] = self.ntfy_include_href.isChecked()
         self.submit_form.emit(data)
@@ -444,6 +460,7 @@ class ExtraToolsPane(QWidget):
     guess_hrcs = Signal()
     add_hrc = Signal(dict)
     assign_workorder = Signal(dict)
+    retry_failed = Signal()
 
     def __init__(self, parent: QWidget = None) -> None:
         super().__init__(parent)
@@ -452,6 +469,7 @@ class ExtraToolsPane(QWidget):
             "Guess HRCs for all workorders",
             "(Re)Assign workorder",
             "Fix missing primary",
+            "Retry failed jobs",
         )
         hrcs = (
             "100 - REFIG MONITORING",
@@ -484,6 +502,7 @@ class ExtraToolsPane(QWidget):
         self.workorder_assign = QLineEdit()
         self.phase_assign = QLineEdit()
         self.shop_people = QListWidget()
+        self.failed_jobs = QListWidget()
 
         self.tool_selector.addItems(self._tools)
         self.shop_people.addItems(CONFIG.shop_people.keys())
@@ -520,11 +539,18 @@ class ExtraToolsPane(QWidget):
         assign_workorder_widget = QWidget(self.stack_container)
         assign_workorder_widget.setLayout(assign_workorder_form)
 
+        # Failed jobs list
+        failed_jobs_form = QFormLayout()
+        failed_jobs_form.addRow("Failed jobs", self.failed_jobs)
+        failed_jobs_widget = QWidget(self.stack_container)
+        failed_jobs_widget.setLayout(failed_jobs_form)
+
         # Add forms to stack
         self.stack.addWidget(add_hrc_widget)
         self.stack.addWidget(placeholder)
         self.stack.addWidget(assign_workorder_widget)
         self.stack.addWidget(placeholder)
+        self.stack.addWidget(failed_jobs_widget)
         self.stack_container.setLayout(self.stack)
 
         # create scroll container, for future use
@@ -544,6 +570,10 @@ class ExtraToolsPane(QWidget):
     def select_tool(self, index: int) -> None:
         self.stack.setCurrentIndex(index)
 
+    @Slot(str)
+    def add_failed_job(self, text: str) -> None:
+        self.failed_jobs.addItem(text)
+
     @Slot()
     def execute(self):
         tool = self.tool_selector.currentIndex()
@@ -596,6 +626,13 @@ class ExtraToolsPane(QWidget):
         elif tool == 3:
             # fix primary
             self.fix_assignments.emit()
+        elif tool == 4:
+            # retry failed jobs
+            if not self.failed_jobs.count():
+                self.message.emit("No failed jobs.")
+                return
+            self.failed_jobs.clear()
+            self.retry_failed.emit()
 
 
 class MainWindow(QMainWindow):
@@ -764,8 +801,10 @@ def run() -> None:
         daemon.processor.finished.connect(window.set_inactive)
         daemon.processor.finished.connect(window.progress_bar.hide)
         daemon.processor.error.connect(window.show_error)
+        daemon.processor.dead_letter.connect(window.tools_pane.add_failed_job)
 
         CONFIG.has_changed.connect(daemon.update)
+        app.aboutToQuit.connect(daemon.stop)
 
         window.workorder_pane.submit_form.connect(daemon.create_workorder)
         window.assignments_pane.submit_form.connect(daemon.create_daily_assignments)
@@ -775,6 +814,7 @@ def run() -> None:
         window.tools_pane.guess_hrcs.connect(daemon.guess_hrcs)
         window.tools_pane.add_hrc.connect(daemon.add_hrc_to_workorder)
         window.tools_pane.assign_workorder.connect(daemon.assign_workorder)
+        window.tools_pane.retry_failed.connect(daemon.processor.retry_failed)
 
         window.show()
 
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+from typing import Callable, Mapping
+
+from PySide6.QtCore import QMutex
+from requests import RequestException, Session
+from requests.cookies import RequestsCookieJar, cookiejar_from_dict
+
+from .settings import CONFIG, COOKIE_FILE
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+# responses meaning AiM no longer accepts our cookies
+AUTH_FAILURES = (301, 302, 303, 401, 403)
+
+
+def load_cookies() -> dict:
+    """Read the stored AiM cookies as a {name: value} dict, empty if there are none"""
+    if not os.path.exists(COOKIE_FILE):
+        return dict()
+    try:
+        with open(COOKIE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.debug(f"ignoring unreadable cookie file: {e}")
+        return dict()
+
+
+def store_cookies(cookies: dict) -> None:
+    """Replace the stored cookies in one step, so readers never see a partial file"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(COOKIE_FILE), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(cookies, f)
+        os.replace(tmp, COOKIE_FILE)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+class CredentialManager(object):
+    """
+    Keeps AiM cookies in memory for every query to share.
+
+    The cookies are checked against AiM at most once per ttl seconds, and
+    new ones are only requested after a check or a query is refused.
+    """
+
+    def __init__(
+        self, refresh: Callable[[], dict], probe_url: str, ttl: int = 0
+    ) -> None:
+        """
+        :param refresh: callable -> logs in and returns fresh cookies as a dict
+        :param probe_url: string -> page that answers 200 only to a logged-in user
+        :param ttl: int -> seconds between checks, defaults to CONFIG.cookie_ttl
+        """
+        self._refresh = refresh
+        self.probe_url = probe_url
+        self.ttl = ttl or CONFIG.cookie_ttl
+        self._cookies: dict | None = None
+        self._checked = 0.0
+        self.mutex = QMutex()
+
+    def _probe(self) -> bool:
+        try:
+            r = Session().get(
+                self.probe_url, cookies=self._cookies, allow_redirects=False
+            )
+        except RequestException as e:
+            logger.debug(f"cookie check failed: {e}")
+            return False
+        if r.status_code != 200:
+            return False
+        self._merge(r.cookies)
+        return True
+
+    def _merge(self, cookies: Mapping) -> None:
+        changed = {k: v for k, v in cookies.items() if self._cookies.get(k) != v}
+        if changed:
+            self._cookies.update(changed)
+            store_cookies(self._cookies)
+
+    def cookies(self) -> RequestsCookieJar:
+        """Valid AiM cookies, logging in again only if AiM rejects the current ones"""
+        self.mutex.lock()
+        try:
+            if self._cookies is None:
+                self._cookies = load_cookies()
+            if time.monotonic() - self._checked > self.ttl:
+                if not (self._cookies and self._probe()):
+                    logger.debug("fetching new cookies")
+                    self._cookies = dict(self._refresh())
+                    store_cookies(self._cookies)
+                self._checked = time.monotonic()
+            return cookiejar_from_dict(self._cookies)
+        finally:
+            self.mutex.unlock()
+
+    def update(self, cookies: Mapping) -> None:
+        """Record cookies AiM sent back with a response. Only writes to disk if they changed"""
+        if not cookies:
+            return
+        self.mutex.lock()
+        try:
+            if self._cookies is None:
+                self._cookies = load_cookies()
+            self._merge(cookies)
+        finally:
+            self.mutex.unlock()
+
+    def invalidate(self) -> None:
+        """Mark the cookies as refused, so the next cookies() call checks them"""
+        self.mutex.lock()
+        self._checked = 0.0
+        self.mutex.unlock()
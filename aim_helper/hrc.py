@@ -0,0 +1,48 @@
+"""Hazard review code (HRC) detection and guessing for workorder descriptions"""
+from __future__ import annotations
+
+import re
+
+from functools import lru_cache
+from typing import Iterable, List, Mapping, Tuple
+
+# Checked in this order, the first code whose pattern appears wins
+HRC_PATTERNS = (
+    ("107", r"\b(?:animals?|primate|lab|fume(?:hood)?)\b"),
+    ("117", r"\blights?\b"),
+    ("109", r"\broof(?:top)?\b"),
+    ("113", r"lift station"),
+)
+DEFAULT_HRC = "110"
+
+_PRIORITY = {f"hrc{code}": n for n, (code, _) in enumerate(HRC_PATTERNS)}
+_GUESS = re.compile(
+    "|".join(f"(?P<hrc{code}>{pattern})" for code, pattern in HRC_PATTERNS),
+    re.IGNORECASE | re.MULTILINE,
+)
+_HAS_HRC = re.compile(r"hrc ?[0-9]{3}", re.IGNORECASE | re.MULTILINE)
+
+
+def has_hrc(description: str) -> bool:
+    return _HAS_HRC.search(description) is not None
+
+
+@lru_cache(maxsize=4096)
+def guess_hrc(description: str) -> str:
+    """Guess the three digit HRC for a description, in one scan of the text"""
+    best = None
+    for m in _GUESS.finditer(description):
+        if best is None or _PRIORITY[m.lastgroup] < _PRIORITY[best]:
+            best = m.lastgroup
+            if _PRIORITY[best] == 0:
+                break
+    return best[3:] if best else DEFAULT_HRC
+
+
+def classify(workorders: Iterable[Mapping]) -> List[Tuple[Mapping, str]]:
+    """Pair every workorder that has no HRC in its description with a guess"""
+    return [
+        (w, guess_hrc(w["description"]))
+        for w in workorders
+        if not has_hrc(w["description"])
+    ]
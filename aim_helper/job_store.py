@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from typing import Any, Dict, Hashable, Iterable, List, Set
+
+from PySide6.QtCore import QMutex
+
+from .settings import CONFIG, JOB_DB
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    key TEXT PRIMARY KEY,
+    action TEXT NOT NULL,
+    http_action TEXT,
+    data TEXT,
+    description TEXT,
+    priority INTEGER NOT NULL,
+    retryable INTEGER NOT NULL DEFAULT 1,
+    state TEXT NOT NULL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS journal (
+    key TEXT PRIMARY KEY,
+    done REAL NOT NULL
+);
+"""
+
+
+def _dump_key(key: Hashable) -> str:
+    return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+
+def _load_key(text: str) -> Hashable:
+    key = json.loads(text)
+    return tuple(key) if isinstance(key, list) else key
+
+
+class JobStore(object):
+    """
+    SQLite record of every job and when it finished, kept in CONFIG_DIR.
+
+    A job is stored when it is queued and its state follows it through
+    running to done or failed, so work still queued or running when the
+    app stopped is picked up again by pending(). Finished jobs also go in
+    the journal, which the fetcher checks to avoid repeating them.
+
+    Jobs are stored as plain records: the caller turns them back into Job
+    objects. One connection is shared between threads behind a mutex.
+    """
+
+    def __init__(self, path: str = JOB_DB) -> None:
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.mutex = QMutex()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "retryable" not in columns:
+            # stores created before jobs could be marked unsafe to repeat
+            self.db.execute(
+                "ALTER TABLE jobs ADD COLUMN retryable INTEGER NOT NULL DEFAULT 1"
+            )
+
+    def __repr__(self) -> str:
+        return f"JobStore({self.path!r}, {self.counts()})"
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        self.mutex.lock()
+        try:
+            return self.db.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"job store: {e}")
+            return list()
+        finally:
+            self.mutex.unlock()
+
+    def put(self, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Store queued jobs in one transaction, replacing any earlier record
+        with the same key unless that job is running right now
+        :param records: dicts -> key, action, http_action, data, description, priority,
+            retryable
+        """
+        now = time.time()
+        rows = [
+            (
+                _dump_key(r["key"]),
+                r["action"],
+                r.get("http_action"),
+                json.dumps(r.get("data")),
+                r.get("description", ""),
+                int(r.get("priority", 0)),
+                int(r.get("retryable", True)),
+                QUEUED,
+                now,
+            )
+            for r in records
+        ]
+        self.mutex.lock()
+        try:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany(
+                    """
+                    INSERT INTO jobs (
+                        key, action, http_action, data, description, priority,
+                        retryable, state, updated
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        data = excluded.data,
+                        description = excluded.description,
+                        priority = MIN(priority, excluded.priority),
+                        state = excluded.state,
+                        error = NULL,
+                        updated = excluded.updated
+                    WHERE state != 'running'
+                    """,
+                    rows,
+                )
+        except sqlite3.Error as e:
+            logger.error(f"job store: {e}")
+        finally:
+            self.mutex.unlock()
+
+    def set_state(self, key: Hashable, state: str, error: str = "") -> None:
+        self._execute(
+            "UPDATE jobs SET state = ?, error = ?, updated = ? WHERE key = ?",
+            (state, error or None, time.time(), _dump_key(key)),
+        )
+
+    def complete(self, key: Hashable) -> None:
+        """Mark a job done and journal it, in one transaction"""
+        now = time.time()
+        text = _dump_key(key)
+        self.mutex.lock()
+        try:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.execute(
+                    "UPDATE jobs SET state = ?, error = NULL, updated = ? WHERE key = ?",
+                    (DONE, now, text),
+                )
+                self.db.execute(
+                    "INSERT OR REPLACE INTO journal (key, done) VALUES (?, ?)",
+                    (text, now),
+                )
+        except sqlite3.Error as e:
+            logger.error(f"job store: {e}")
+        finally:
+            self.mutex.unlock()
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """
+        Jobs left queued or running by the last run, oldest first, reset to
+        queued. Each record's state is the one the job was left in.
+        """
+        rows = self._execute(
+            """
+            SELECT key, action, http_action, data, description, priority,
+                retryable, state
+            FROM jobs WHERE state IN ('queued', 'running') ORDER BY updated
+            """
+        )
+        self._execute("UPDATE jobs SET state = 'queued' WHERE state = 'running'")
+        return [
+            dict(
+                key=_load_key(key),
+                action=action,
+                http_action=http_action,
+                data=json.loads(data),
+                description=description,
+                priority=priority,
+                retryable=bool(retryable),
+                state=state,
+            )
+            for key, action, http_action, data, description, priority, retryable, state in rows
+        ]
+
+    def failed(self) -> List[Dict[str, Any]]:
+        """Dead-lettered jobs, with the error that stopped them"""
+        rows = self._execute(
+            """
+            SELECT key, action, http_action, data, description, priority,
+                retryable, error
+            FROM jobs WHERE state = 'failed' ORDER BY updated
+            """
+        )
+        return [
+            dict(
+                key=_load_key(key),
+                action=action,
+                http_action=http_action,
+                data=json.loads(data),
+                description=description,
+                priority=priority,
+                retryable=bool(retryable),
+                error=error,
+            )
+            for key, action, http_action, data, description, priority, retryable, error in rows
+        ]
+
+    def journaled(self, days: int = 0) -> Set[Hashable]:
+        """
+        Keys of every job finished within the journal window
+        :param days: int -> size of the window, defaults to CONFIG.journal_days
+        """
+        cutoff = time.time() - (days or CONFIG.journal_days) * 24 * 60 * 60
+        rows = self._execute("SELECT key FROM journal WHERE done >= ?", (cutoff,))
+        return {_load_key(key) for (key,) in rows}
+
+    def counts(self) -> Dict[str, int]:
+        return dict(self._execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def prune(self, days: int) -> None:
+        """Forget finished jobs and journal entries older than the given number of days"""
+        cutoff = time.time() - days * 24 * 60 * 60
+        self._execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated < ?",
+            (cutoff,),
+        )
+        self._execute("DELETE FROM journal WHERE done < ?", (cutoff,))
+
+    def close(self) -> None:
+        self.mutex.lock()
+        self.db.close()
+        self.mutex.unlock()
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Container, Dict, Iterable, List, Tuple
+
+from PySide6.QtCore import QMutex, QWaitCondition
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+
+from .settings import CONFIG, OUTBOX_DB
+from .worklist import Workorder
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+AIM_URL_TEMPLATE = "https://washington.assetworks.hosting/fmax/screen/PHASE_VIEW?proposal={}&sortCode={}"
+TITLE = "New urgent work request(s)"
+TIMEOUT = 10
+RETRY_DELAY = 2
+
+
+def format_urgent(workorders: Iterable[Workorder]) -> str:
+    """One ntfy message body listing every workorder"""
+    parts = list()
+    for wo in workorders:
+        if CONFIG.ntfy_include_href:
+            url = AIM_URL_TEMPLATE.format(wo["proposal"], wo["sortCode"])
+            parts.append(f"[{wo['proposal']} {wo['sortCode']}]({url}) :\n {wo['description']}\n\n")
+        else:
+            parts.append(f"{wo['proposal']} {wo['sortCode']}:\n {wo['description']}\n\n")
+    return "".join(parts)
+
+
+class Outbox(object):
+    """
+    On-disk record of every urgent workorder seen and whether it has been
+    announced, so work is announced once, even across restarts, and sends
+    cut short by a crash are made on the next start.
+
+    A new outbox treats the first urgent work it is given as announced
+    already, rather than announcing everything open at once.
+    """
+
+    def __init__(self, path: str = OUTBOX_DB) -> None:
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.mutex = QMutex()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        # True until the work open when the outbox was created is recorded
+        self.seeding = not self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'outbox'"
+        ).fetchone()
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                proposal TEXT NOT NULL,
+                sortCode TEXT NOT NULL,
+                workorder TEXT NOT NULL,
+                sent REAL,
+                PRIMARY KEY (proposal, sortCode)
+            )
+            """
+        )
+        self.sent = {
+            (proposal, sortCode)
+            for proposal, sortCode in self.db.execute(
+                "SELECT proposal, sortCode FROM outbox WHERE sent IS NOT NULL"
+            )
+        }
+
+    def __repr__(self) -> str:
+        return f"Outbox({self.path!r}, sent={len(self.sent)})"
+
+    def unsent(self, workorders: Iterable[Workorder]) -> List[Workorder]:
+        """Record the workorders as pending, returning those not yet announced"""
+        self.mutex.lock()
+        try:
+            unsent = [wo for wo in workorders if wo.key not in self.sent]
+            seeding = self.seeding
+            sent = time.time() if seeding else None
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO outbox VALUES (?, ?, ?, ?)",
+                    [(*wo.key, json.dumps(dict(wo)), sent) for wo in unsent],
+                )
+            if seeding:
+                logger.debug(f"new outbox, {len(unsent)} open urgent workorders marked sent")
+                self.sent.update(wo.key for wo in unsent)
+                self.seeding = False
+                unsent = list()
+        except sqlite3.Error as e:
+            logger.error(f"outbox: {e}")
+        finally:
+            self.mutex.unlock()
+        return unsent
+
+    def pending(self) -> List[Workorder]:
+        self.mutex.lock()
+        try:
+            rows = self.db.execute(
+                "SELECT workorder FROM outbox WHERE sent IS NULL"
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"outbox: {e}")
+            rows = list()
+        finally:
+            self.mutex.unlock()
+        return [Workorder(json.loads(data)) for (data,) in rows]
+
+    def mark_sent(self, keys: Iterable[Tuple[str, str]]) -> None:
+        keys = list(keys)
+        now = time.time()
+        self.mutex.lock()
+        try:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany(
+                    "UPDATE outbox SET sent = ? WHERE proposal = ? AND sortCode = ?",
+                    [(now, *key) for key in keys],
+                )
+            self.sent.update(keys)
+        except sqlite3.Error as e:
+            logger.error(f"outbox: {e}")
+        finally:
+            self.mutex.unlock()
+
+    def prune(self, days: int, open_keys: Container[Tuple[str, str]]) -> None:
+        """
+        Forget workorders announced more than the given number of days ago
+        that are no longer open, so open work is never announced twice
+        :param open_keys: keys of the workorders in the New query
+        """
+        cutoff = time.time() - days * 24 * 60 * 60
+        self.mutex.lock()
+        try:
+            rows = [
+                key
+                for key in self.db.execute(
+                    "SELECT proposal, sortCode FROM outbox WHERE sent < ?", (cutoff,)
+                )
+                if key not in open_keys
+            ]
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany(
+                    "DELETE FROM outbox WHERE proposal = ? AND sortCode = ?", rows
+                )
+            self.sent.difference_update(rows)
+        except sqlite3.Error as e:
+            logger.error(f"outbox: {e}")
+        finally:
+            self.mutex.unlock()
+
+    def close(self) -> None:
+        self.mutex.lock()
+        self.db.close()
+        self.mutex.unlock()
+
+
+class NtfyDispatcher(object):
+    """
+    Sends urgent workorder notifications to CONFIG.ntfy_url in the background.
+
+    notify() records the workorders in the outbox, queues those not yet
+    announced and returns. A single sender thread waits ntfy_window seconds
+    for the rest of a burst, then posts everything queued as one message
+    over a kept-alive connection, no sooner than ntfy_interval seconds after
+    the previous message. Failed posts are retried with backoff up to
+    ntfy_retries times, and after that stay in the outbox for the next call.
+    """
+
+    def __init__(
+        self, outbox: Outbox | None = None, session: Session | None = None
+    ) -> None:
+        self.outbox = outbox or Outbox()
+        self.session = session or Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=1))
+        self.mutex = QMutex()
+        self.wake = QWaitCondition()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ntfy")
+        self.sent = 0
+        self.failed = 0
+        self._pending: Dict[Tuple[str, str], Workorder] = dict()
+        self._sending: set = set()
+        self._scheduled = False
+        self._closing = False
+        self._last_sent = 0.0
+
+    def __repr__(self) -> str:
+        return f"NtfyDispatcher(sent={self.sent}, failed={self.failed})"
+
+    def notify(self, workorders: List[Workorder]) -> None:
+        """Announce whichever of the workorders have not been announced yet"""
+        workorders = self.outbox.unsent(workorders)
+        if not workorders:
+            return
+        self.mutex.lock()
+        self._pending.update(
+            (wo.key, wo) for wo in workorders if wo.key not in self._sending
+        )
+        if not self._pending:
+            self.mutex.unlock()
+            return
+        schedule = not self._scheduled and not self._closing
+        self._scheduled = True
+        self.mutex.unlock()
+        if schedule:
+            self.executor.submit(self._drain)
+
+    def resume(self) -> None:
+        """Send what a previous run recorded but never announced"""
+        pending = self.outbox.pending()
+        if pending:
+            logger.debug(f"resending {len(pending)} urgent workorders")
+            self.notify(pending)
+
+    def close(self) -> None:
+        """Send whatever is queued right away and stop the sender"""
+        self.mutex.lock()
+        self._closing = True
+        self.wake.wakeAll()
+        self.mutex.unlock()
+        self.executor.shutdown(wait=True)
+        self.outbox.close()
+
+    def _drain(self) -> None:
+        while True:
+            self.mutex.lock()
+            # let the rest of a burst arrive, and keep to the rate limit
+            due = max(
+                time.monotonic() + CONFIG.ntfy_window,
+                self._last_sent + CONFIG.ntfy_interval,
+            )
+            while not self._closing and (wait := due - time.monotonic()) > 0:
+                self.wake.wait(self.mutex, int(wait * 1000) + 1)
+            batch = list(self._pending.values())
+            self._pending.clear()
+            self._sending = {wo.key for wo in batch}
+            self.mutex.unlock()
+
+            if self._send(batch):
+                self.outbox.mark_sent(wo.key for wo in batch)
+
+            self.mutex.lock()
+            self._sending = set()
+            done = not self._pending
+            if done:
+                self._scheduled = False
+            self.mutex.unlock()
+            if done:
+                return
+
+    def _send(self, workorders: List[Workorder]) -> bool:
+        msg = format_urgent(workorders).encode(encoding="utf-8")
+        for attempt in range(CONFIG.ntfy_retries):
+            delay = RETRY_DELAY * 2**attempt
+            try:
+                r = self.session.post(
+                    CONFIG.ntfy_url,
+                    data=msg,
+                    headers={"Title": TITLE, "Markdown": "yes"},
+                    timeout=TIMEOUT,
+                )
+            except RequestException as e:
+                logger.debug(f"ntfy post failed: {e}")
+            else:
+                if r.ok:
+                    self._last_sent = time.monotonic()
+                    self.sent += len(workorders)
+                    logger.debug(f"notified {len(workorders)} urgent workorders")
+                    return True
+                logger.debug(f"ntfy post refused: {r.status_code}")
+                if r.status_code != 429 and r.status_code < 500:
+                    break
+                if r.headers.get("Retry-After", "").isdigit():
+                    delay = int(r.headers["Retry-After"])
+            if attempt + 1 < CONFIG.ntfy_retries:
+                time.sleep(delay)
+        self._last_sent = time.monotonic()
+        self.failed += len(workorders)
+        logger.error(f"could not notify {len(workorders)} urgent workorders")
+        return False
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import logging
+
+from requests import Session
+
+from .cookie_store import AUTH_FAILURES
+from .settings import CONFIG
+from .worklist import AIM_BASE, CREDENTIALS, HEADERS, get_cookies
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+AIM_API_PHASE = "api/v3/phases/{}/{}"
+TIMEOUT = 30
+
+
+class PhaseApi(object):
+    """
+    Edits workorder phases through the AiM REST API, one request per change.
+
+    Every method returns False instead of raising when the request could not
+    be made or was refused, so the caller can fall back to the browser.
+    """
+
+    def __init__(self, base: str = AIM_BASE, session: Session | None = None) -> None:
+        self.base = base
+        self.session = session or Session()
+        self.session.headers.update(HEADERS)
+        self._authenticated = False
+
+    def _url(self, workorder: str, phase: str) -> str:
+        return self.base + AIM_API_PHASE.format(workorder, phase)
+
+    def _request(self, method: str, workorder: str, phase: str, **kwargs):
+        try:
+            if not self._authenticated:
+                self.session.cookies = get_cookies()
+                self._authenticated = True
+            r = self.session.request(
+                method,
+                self._url(workorder, phase),
+                allow_redirects=False,
+                timeout=TIMEOUT,
+                **kwargs,
+            )
+        except Exception as e:
+            # a RequestException, or anything from the browser a cookie
+            # refresh had to launch
+            logger.debug(f"{method} {workorder}-{phase} failed: {e}")
+            return None
+        logger.debug(f"{method} {workorder}-{phase}: {r.status_code}")
+        if r.status_code in AUTH_FAILURES:
+            # check, and if needed renew, the cookies on the next call
+            CREDENTIALS.invalidate()
+            self._authenticated = False
+            return None
+        if not r.ok:
+            return None
+        CREDENTIALS.update(r.cookies)
+        return r
+
+    @staticmethod
+    def _fields(r) -> dict | None:
+        try:
+            fields = r.json()["fields"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        return fields if isinstance(fields, dict) else None
+
+    def get_phase(self, workorder: str, phase: str) -> dict | None:
+        r = self._request("GET", workorder, phase)
+        if r is None:
+            return None
+        return self._fields(r)
+
+    def update_phase(self, workorder: str, phase: str, **fields: str) -> bool:
+        """
+        Set fields on a workorder phase
+        :param workorder: string -> workorder number
+        :param phase: string -> phase
+        :param fields: field names as returned by PHASE_SEARCH, e.g. statusCode
+        :return: True only if the phase AiM sends back holds the new values
+        """
+        r = self._request("PATCH", workorder, phase, json={"fields": fields})
+        if r is None:
+            return False
+        applied = self._fields(r)
+        if applied is None or any(applied.get(k) != v for k, v in fields.items()):
+            logger.debug(f"PATCH {workorder}-{phase} not applied: {applied}")
+            return False
+        return True
+
+    def change_status(self, workorder: str, phase: str, status: str) -> bool:
+        fields = {"statusCode": status}
+        if status == "HOLD":
+            fields["priCode"] = "500 SCHEDULED"
+        return self.update_phase(workorder, phase, **fields)
+
+    def deprioritize(
+        self, workorder: str, phase: str, priority: str = "500 SCHEDULED"
+    ) -> bool:
+        return self.update_phase(workorder, phase, priCode=priority)
+
+    def add_hrc(self, workorder: str, phase: str, hrc: str) -> bool:
+        if not hrc:
+            return False
+        if hrc.isnumeric():
+            hrc = f"HRC{hrc}"
+        fields = self.get_phase(workorder, phase)
+        if fields is None:
+            return False
+        desc = fields.get("description", "")
+        if len(desc) > 198:
+            desc = desc[:-8]
+        return self.update_phase(workorder, phase, description=f"{desc}\n{hrc}")
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from PySide6.QtCore import QMutex
+from requests import Response
+
+from .settings import CONFIG
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class CachedResponse(object):
+    __slots__ = ("etag", "last_modified", "digest", "size", "value")
+
+    def __init__(self, r: Response, digest: str, value: Any) -> None:
+        self.etag = r.headers.get("ETag")
+        self.last_modified = r.headers.get("Last-Modified")
+        self.digest = digest
+        self.size = len(r.content)
+        self.value = value
+
+
+class ResponseCache(object):
+    """
+    The parsed result of the last response to each URL, so an unchanged
+    payload is neither decoded nor turned into objects again.
+
+    Requests carry If-None-Match / If-Modified-Since when the previous
+    response had an ETag / Last-Modified, and a 304 reuses the cached
+    result. Without validators a response whose body hashes the same as
+    last time is a hit too. Least recently used entries are evicted past
+    max_entries or max_bytes of response body.
+    """
+
+    def __init__(self, max_entries: int = 0, max_bytes: int = MAX_BYTES) -> None:
+        self.max_entries = max_entries or CONFIG.response_cache_entries
+        self.max_bytes = max_bytes
+        self.__entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self.__bytes = 0
+        self.hits = 0
+        self.not_modified = 0
+        self.misses = 0
+        self.evictions = 0
+        self.mutex = QMutex()
+
+    def __len__(self) -> int:
+        self.mutex.lock()
+        r = len(self.__entries)
+        self.mutex.unlock()
+        return r
+
+    def __repr__(self) -> str:
+        return (
+            f"ResponseCache(entries={len(self)}, hits={self.hits},"
+            f" not_modified={self.not_modified}, misses={self.misses},"
+            f" evictions={self.evictions})"
+        )
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for the url, empty if nothing is cached"""
+        self.mutex.lock()
+        entry = self.__entries.get(url)
+        self.mutex.unlock()
+        headers = dict()
+        if entry is not None and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def lookup(self, url: str, r: Response) -> Tuple[Any, str]:
+        """
+        Cached result for a response, or None if it must be parsed
+        :return: (result or None, body digest to pass to put)
+        """
+        digest = "" if r.status_code == 304 else hashlib.sha1(r.content).hexdigest()
+        self.mutex.lock()
+        try:
+            entry = self.__entries.get(url)
+            if entry is not None and (r.status_code == 304 or entry.digest == digest):
+                self.__entries.move_to_end(url)
+                if r.status_code == 304:
+                    self.not_modified += 1
+                else:
+                    self.hits += 1
+                    # the server may have started sending validators
+                    entry.etag = r.headers.get("ETag")
+                    entry.last_modified = r.headers.get("Last-Modified")
+                return entry.value, digest
+            self.misses += 1
+            return None, digest
+        finally:
+            self.mutex.unlock()
+
+    def put(self, url: str, r: Response, digest: str, value: Any) -> None:
+        entry = CachedResponse(r, digest, value)
+        if entry.size > self.max_bytes:
+            return
+        self.mutex.lock()
+        old = self.__entries.pop(url, None)
+        if old is not None:
+            self.__bytes -= old.size
+        self.__entries[url] = entry
+        self.__bytes += entry.size
+        while len(self.__entries) > self.max_entries or self.__bytes > self.max_bytes:
+            _, evicted = self.__entries.popitem(last=False)
+            self.__bytes -= evicted.size
+            self.evictions += 1
+        self.mutex.unlock()
+
+    def clear(self) -> None:
+        self.mutex.lock()
+        self.__entries.clear()
+        self.__bytes = 0
+        self.mutex.unlock()
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import logging
+import random
+
+from datetime import datetime, timedelta
+from typing import Dict
+
+from PySide6.QtCore import QObject, QTimer, Signal, Slot
+
+from .settings import CONFIG
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+# QTimer intervals are a signed 32 bit count of milliseconds
+MAX_WAIT = 24 * 60 * 60
+# seconds between fetches of a query whose schedule sets no interval
+DEFAULT_INTERVAL = 300
+# CONFIG fields that can change when a query is next due
+SCHEDULE_KEYS = frozenset(("schedules", "queries"))
+
+
+def in_window(schedule: dict, when: datetime) -> bool:
+    hours = schedule.get("hours")
+    days = schedule.get("days")
+    if days is not None and when.weekday() not in days:
+        return False
+    if hours is not None and not hours[0] <= when.hour < hours[1]:
+        return False
+    return True
+
+
+def next_run(schedule: dict, now: datetime) -> datetime:
+    """
+    When a query should next be fetched: one interval from now, give or
+    take the jitter, moved to the start of the next window if that falls
+    outside the query's hours and days
+
+    Schedule settings:
+        interval: seconds between fetches, DEFAULT_INTERVAL if left out
+        jitter: at most this many seconds earlier or later, spreading queries apart
+        hours: [first, last) local hours the query is fetched in
+        days: weekdays the query is fetched on, Monday is 0
+    """
+    interval = schedule.get("interval", DEFAULT_INTERVAL)
+    jitter = schedule.get("jitter", 0)
+    when = now + timedelta(seconds=max(1, interval + random.uniform(-jitter, jitter)))
+    if in_window(schedule, when):
+        return when
+    # step to the top of each hour until the window opens, at most a week on
+    when = when.replace(minute=0, second=0, microsecond=0)
+    for _ in range(7 * 24):
+        when += timedelta(hours=1)
+        if in_window(schedule, when):
+            return when
+    logger.error(f"schedule {schedule} has no open window, using the interval")
+    return now + timedelta(seconds=interval)
+
+
+class RefreshScheduler(QObject):
+    """
+    Signals when each query in CONFIG.queries is due for a fetch, following
+    its entry in CONFIG.schedules, with one single-shot timer per query.
+    A config change re-arms only the queries whose schedule it changed.
+    """
+
+    due = Signal(list)
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.timers: Dict[str, QTimer] = dict()
+        self.next: Dict[str, datetime] = dict()
+        # the schedule each query's timer was armed with
+        self.armed: Dict[str, dict] = dict()
+        self.running = False
+        CONFIG.has_changed.connect(self.on_config_changed)
+
+    def start(self) -> None:
+        self.running = True
+        for source in CONFIG.queries:
+            self._arm(source)
+
+    def stop(self) -> None:
+        self.running = False
+        for timer in self.timers.values():
+            timer.stop()
+
+    @Slot(str)
+    def on_config_changed(self, key: str) -> None:
+        if key in SCHEDULE_KEYS:
+            self.reschedule()
+
+    @Slot()
+    def reschedule(self) -> None:
+        """Re-arm the queries whose schedule changed, keeping the others' next fetch"""
+        if not self.running:
+            return
+        for source in [s for s in self.timers if s not in CONFIG.queries]:
+            self.timers.pop(source).stop()
+            self.next.pop(source, None)
+            self.armed.pop(source, None)
+        for source in CONFIG.queries:
+            if self.armed.get(source) != self._schedule(source):
+                self._arm(source)
+
+    def on_timeout(self, source: str) -> None:
+        if datetime.now() < self.next[source]:
+            # a wait longer than MAX_WAIT is made in steps
+            self._wait(source)
+            return
+        self.due.emit([source])
+        self._arm(source)
+
+    def _schedule(self, source: str) -> dict:
+        schedule = dict(CONFIG.schedules.get(source, dict()))
+        schedule.setdefault("interval", DEFAULT_INTERVAL)
+        return schedule
+
+    def _arm(self, source: str) -> None:
+        if source not in self.timers:
+            timer = QTimer(self)
+            timer.setSingleShot(True)
+            timer.timeout.connect(lambda source=source: self.on_timeout(source))
+            self.timers[source] = timer
+        schedule = self.armed[source] = self._schedule(source)
+        self.next[source] = next_run(schedule, datetime.now())
+        logger.debug(f"next {source} fetch at {self.next[source]:%a %H:%M:%S}")
+        self._wait(source)
+
+    def _wait(self, source: str) -> None:
+        seconds = (self.next[source] - datetime.now()).total_seconds()
+        self.timers[source].start(int(min(max(seconds, 0), MAX_WAIT) * 1000))
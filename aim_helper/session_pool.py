@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import logging
+import shutil
+import socket
+import tempfile
+import time
+
+from typing import Dict, List, Tuple
+
+from PySide6.QtCore import QMutex
+
+from .aim_session import AIM_BASE, AimSession
+from .settings import CONFIG
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SessionPool(object):
+    """
+    Keeps logged-in AimSession objects warm between batches, so each batch
+    doesn't pay for a fresh browser launch and SSO login.
+
+    The first session uses the configured browser profile. Any session
+    launched while that one is alive gets its own throwaway profile and
+    debugging port, so several browsers can run side by side.
+    """
+
+    def __init__(self, size: int = 1, idle_timeout: int = 0) -> None:
+        self.size = size
+        self.idle_timeout = idle_timeout or CONFIG.session_idle_timeout
+        self.reused = 0
+        self.launched = 0
+        self.__idle: List[Tuple[AimSession, float]] = list()
+        # id(session) -> (session, throwaway profile dir or "" for the
+        # configured profile), for every session launched and not shut down
+        self.__live: Dict[int, Tuple[AimSession, str]] = dict()
+        self.__shared_in_use = False
+        self.mutex = QMutex()
+
+    def __len__(self) -> int:
+        self.mutex.lock()
+        r = len(self.__idle)
+        self.mutex.unlock()
+        return r
+
+    def __repr__(self) -> str:
+        return f"SessionPool(idle={len(self)}, reused={self.reused}, launched={self.launched})"
+
+    def _pop_idle(self) -> AimSession | None:
+        self.mutex.lock()
+        r = self.__idle.pop()[0] if self.__idle else None
+        self.mutex.unlock()
+        return r
+
+    def _is_healthy(self, aim: AimSession) -> bool:
+        """Check that the driver still responds, logging back in if AiM expired the session"""
+        try:
+            aim.driver.current_url
+            # login() is a single page load when the session is still valid
+            aim.login()
+            return AIM_BASE in aim.driver.current_url
+        except Exception as e:
+            # urllib3 errors, not WebDriverException, once chromedriver has died
+            logger.debug(f"discarding unhealthy session: {e}")
+            return False
+
+    def _launch(self) -> AimSession:
+        self.mutex.lock()
+        shared = not self.__shared_in_use
+        self.__shared_in_use = True
+        self.mutex.unlock()
+        profile = "" if shared else tempfile.mkdtemp(prefix="aimhelper-")
+        try:
+            if shared:
+                aim = AimSession(netid=CONFIG.netid, debug=CONFIG.debug)
+            else:
+                aim = AimSession(
+                    netid=CONFIG.netid,
+                    debug=CONFIG.debug,
+                    profile=profile,
+                    port=_free_port(),
+                )
+        except Exception:
+            self._free_profile(profile)
+            raise
+        self.mutex.lock()
+        self.__live[id(aim)] = (aim, profile)
+        self.mutex.unlock()
+        try:
+            aim.login()
+        except Exception:
+            self._shutdown(aim)
+            raise
+        self.launched += 1
+        return aim
+
+    def _free_profile(self, profile: str) -> None:
+        if profile:
+            shutil.rmtree(profile, ignore_errors=True)
+            return
+        self.mutex.lock()
+        self.__shared_in_use = False
+        self.mutex.unlock()
+
+    def _shutdown(self, aim: AimSession) -> None:
+        """Quit the browser and free its profile for the next launch"""
+        self.mutex.lock()
+        entry = self.__live.pop(id(aim), None)
+        self.mutex.unlock()
+        if entry is None:
+            # already shut down by close_all
+            return
+        aim.quit()
+        self._free_profile(entry[1])
+
+    def acquire(self) -> AimSession:
+        """Get a logged-in session, reusing an idle one when possible"""
+        self.reap()
+        while (aim := self._pop_idle()) is not None:
+            if self._is_healthy(aim):
+                self.reused += 1
+                logger.debug(f"reusing warm session: {self}")
+                return aim
+            self._shutdown(aim)
+        aim = self._launch()
+        logger.debug(f"launched cold session: {self}")
+        return aim
+
+    def release(self, aim: AimSession, discard: bool = False) -> None:
+        """Return a session to the pool, or shut it down if it is broken or surplus"""
+        self.mutex.lock()
+        keep = not discard and len(self.__idle) < self.size
+        if keep:
+            self.__idle.append((aim, time.monotonic()))
+        self.mutex.unlock()
+        if not keep:
+            self._shutdown(aim)
+
+    def reap(self) -> None:
+        """Shut down sessions that have been idle longer than idle_timeout"""
+        now = time.monotonic()
+        self.mutex.lock()
+        expired = [a for a, t in self.__idle if now - t > self.idle_timeout]
+        self.__idle = [(a, t) for a, t in self.__idle if now - t <= self.idle_timeout]
+        self.mutex.unlock()
+        for aim in expired:
+            logger.debug("closing idle session")
+            self._shutdown(aim)
+
+    def close_all(self) -> None:
+        """Shut down every session, idle or still handed out"""
+        self.mutex.lock()
+        live = [aim for aim, _ in self.__live.values()]
+        self.__idle = list()
+        self.mutex.unlock()
+        for aim in live:
+            self._shutdown(aim)
@@ -18,6 +18,8 @@ HOME = os.path.expanduser("~")
 CONFIG_DIR = os.path.join(user_config_dir(), "AimHelper")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
 COOKIE_FILE = os.path.join(CONFIG_DIR, "cookies.json")
+JOB_DB = os.path.join(CONFIG_DIR, "jobs.sqlite3")
+OUTBOX_DB = os.path.join(CONFIG_DIR, "outbox.sqlite3")
 LOG_FILE = os.path.join(user_log_dir(), "aimhelper.log")
 os.makedirs(user_log_dir(), exist_ok=True)
 
@@ -69,10 +71,60 @@ BUILDINGS = {
 }
 
 PRIORITY_CODES = ("300 HIGH", "400 ROUTINE", "500 SCHEDULED")
+URGENT_CODES = ("300 HIGH", "200 URGENT", "100 EMERGENCY")
 
 CANCEL_REGEX = "\\b(an(n)ual.*Maintenance|pm)\\b"
 HOLD_REGEX = "fire|transfer switch"
 
+# AiM saved searches the daemon fetches, by the name rules refer to them
+QUERIES = {
+    "new": "17 Elec New Work",
+    "active": "17 Elec All Active",
+    "hold": "17 Elec HOLD",
+}
+
+# How often each query is fetched. See schedule.next_run
+SCHEDULES = {
+    "new": {"interval": 60, "jitter": 10},
+    "active": {"interval": 600, "jitter": 60, "hours": [6, 18], "days": [0, 1, 2, 3, 4]},
+    "hold": {"interval": 86400, "jitter": 600},
+}
+
+# Checked in order, the first matching rule decides. See triage.Rule
+TRIAGE_RULES = [
+    {
+        "name": "real pm",
+        "action": "HOLD",
+        "source": "new",
+        "regex_setting": "hold_regex",
+        "priorities": ["800 PREVENTIVE"],
+    },
+    {
+        "name": "fake pm",
+        "action": "CANCEL",
+        "source": "new",
+        "regex_setting": "cancel_regex",
+    },
+    {
+        "name": "urgent",
+        "action": "NOTIFY",
+        "source": "new",
+        "priorities": list(URGENT_CODES),
+    },
+    {
+        "name": "past due",
+        "action": "DE_ESCALATE",
+        "source": "active",
+        "older_than_days": {"200 URGENT": 1, "300 HIGH": 7, "400 ROUTINE": 25},
+    },
+    {
+        "name": "stale hold",
+        "action": "CANCEL",
+        "source": "hold",
+        "older_than_days": 365,
+    },
+]
+
 @dataclass
 class Config(QObject):
     netid: str = ""
@@ -82,11 +134,30 @@ class Config(QObject):
     chrome_profile: str = CHROME_PROFILE
     shop: str = "17 ELECTRICAL"
     shop_people: dict = field(default_factory=lambda: SHOP_PEOPLE)
+    # ms between resends of urgent notifications that failed, fetches
+    # follow schedules
     refresh: int = 300000
+    session_idle_timeout: int = 900
+    workers: int = 1
+    http_writes: bool = False
+    cookie_ttl: int = 600
+    assignment_ttl: int = 1800
+    response_cache_entries: int = 256
+    journal_days: int = 30
+    job_timeout: int = 300
+    job_retries: int = 3
+    retry_delay: int = 10
+    recycle_after: int = 2
+    ntfy_window: int = 5
+    ntfy_interval: int = 30
+    ntfy_retries: int = 3
     buildings: dict = field(default_factory=lambda: BUILDINGS)
     debug: bool = True
     cancel_regex: str = CANCEL_REGEX
     hold_regex: str = HOLD_REGEX
+    queries: dict = field(default_factory=lambda: dict(QUERIES))
+    schedules: dict = field(default_factory=lambda: dict(SCHEDULES))
+    triage_rules: list = field(default_factory=lambda: list(TRIAGE_RULES))
     ntfy_include_href = False
     has_changed = Signal(str)
 
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import logging
+import re
+
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple
+
+from PySide6.QtCore import QObject, Slot
+
+from .settings import CONFIG
+from .worklist import Workorder
+
+logger = logging.getLogger(__name__)
+if CONFIG.debug:
+    logger.setLevel(logging.DEBUG)
+
+
+class JobAction(Enum):
+    ADD_HRC = 0
+    ASSIGN = 1
+    CANCEL = 2
+    DE_ESCALATE = 3
+    HOLD = 4
+    NOTIFY = 5
+
+
+# JobAction -> {Workorder.key: Workorder}
+JobPlan = Dict[JobAction, Dict[Tuple[str, str], Workorder]]
+
+
+class Rule(object):
+    """
+    A compiled triage rule. Every condition given must hold for a workorder
+    to match; conditions left out of the rule always hold.
+
+    Rule settings:
+        name: shown in the log
+        action: JobAction name
+        source: key in CONFIG.queries of the query the rule applies to
+        regex: pattern the description must contain, case insensitive
+        regex_setting: name of the CONFIG field holding the pattern instead
+        priorities: list of allowed priCode values
+        older_than_days: minimum age, or a {priCode: days} mapping, where
+            other priority codes never match
+        since_last_run: only workorders entered since the previous fetch
+    """
+
+    def __init__(self, settings: dict) -> None:
+        self.name = settings.get("name", "unnamed rule")
+        try:
+            self.action = JobAction[settings["action"]]
+        except KeyError:
+            raise ValueError(f"{self.name}: unknown action {settings.get('action')}")
+        self.source = settings.get("source", "new")
+        pattern = settings.get("regex")
+        if "regex_setting" in settings:
+            pattern = getattr(CONFIG, settings["regex_setting"])
+        self.pattern = (
+            re.compile(pattern, re.IGNORECASE | re.MULTILINE) if pattern else None
+        )
+        priorities = settings.get("priorities")
+        self.priorities = frozenset(priorities) if priorities else None
+        age = settings.get("older_than_days")
+        if isinstance(age, dict):
+            self.older_than = {k: timedelta(days=v) for k, v in age.items()}
+        elif age is not None:
+            self.older_than = timedelta(days=age)
+        else:
+            self.older_than = None
+        self.since_last_run = settings.get("since_last_run", False)
+        self.needs_date = self.older_than is not None or self.since_last_run
+
+    def __repr__(self) -> str:
+        return f"Rule({self.name!r}, {self.action.name}, source={self.source!r})"
+
+    def matches(
+        self, wo: Workorder, entered: datetime | None, now: datetime, last_run: datetime
+    ) -> bool:
+        if self.priorities is not None and wo["priCode"] not in self.priorities:
+            return False
+        if self.needs_date and entered is None:
+            return False
+        if self.older_than is not None:
+            if isinstance(self.older_than, dict):
+                limit = self.older_than.get(wo["priCode"])
+                if limit is None:
+                    return False
+            else:
+                limit = self.older_than
+            if now - entered <= limit:
+                return False
+        if self.since_last_run and entered < last_run:
+            return False
+        if self.pattern is not None and not self.pattern.search(wo["description"]):
+            return False
+        return True
+
+
+class TriageEngine(QObject):
+    """
+    Sorts fetched workorders into a JobPlan using the rules in
+    CONFIG.triage_rules, compiled once and again whenever the config changes.
+    Rules are tried in order and the first one that matches decides.
+    """
+
+    def __init__(self, parent: QObject = None) -> None:
+        super().__init__(parent)
+        self.rules: Dict[str, List[Rule]] = dict()
+        self.compile()
+        CONFIG.has_changed.connect(self.on_config_changed)
+
+    @Slot(str)
+    def on_config_changed(self, key: str) -> None:
+        if self.depends_on(key):
+            self.compile()
+
+    def depends_on(self, key: str) -> bool:
+        """True if changing the CONFIG field can change what the rules decide"""
+        if key in ("triage_rules", "queries"):
+            return True
+        return any(s.get("regex_setting") == key for s in CONFIG.triage_rules)
+
+    def compile(self) -> None:
+        rules = dict()
+        for settings in CONFIG.triage_rules:
+            try:
+                rule = Rule(settings)
+            except (ValueError, AttributeError, re.error) as e:
+                logger.error(f"skipping triage rule {settings}: {e}")
+                continue
+            rules.setdefault(rule.source, list()).append(rule)
+        # replaced in one step, so a running plan() keeps a consistent set
+        self.rules = rules
+        logger.debug(f"compiled triage rules: {rules}")
+
+    def needs_all_rows(self, source: str) -> bool:
+        """
+        True if a rule for the source depends on the clock, so unchanged
+        records can start matching and every row must be planned again
+        """
+        return any(r.older_than is not None for r in self.rules.get(source, ()))
+
+    def plan(
+        self, sources: Dict[str, Iterable[Workorder]], last_run: datetime
+    ) -> JobPlan:
+        """
+        Classify workorders in a single pass
+
+        Args:
+            sources (dict): query key -> workorders, may be a stream
+            last_run (datetime): time of the previous fetch
+
+        Returns:
+            JobPlan: matched workorders grouped by action
+        """
+        rules = self.rules
+        now = datetime.now().astimezone()
+        plan: JobPlan = dict()
+        for source, workorders in sources.items():
+            source_rules = rules.get(source, ())
+            if not source_rules:
+                continue
+            needs_date = any(r.needs_date for r in source_rules)
+            for wo in workorders:
+                entered = wo.entered if needs_date else None
+                for rule in source_rules:
+                    if rule.matches(wo, entered, now, last_run):
+                        plan.setdefault(rule.action, dict())[wo.key] = wo
+                        break
+        return plan
+
+
+def merge_plans(*plans: JobPlan) -> JobPlan:
+    merged: JobPlan = dict()
+    for plan in plans:
+        for action, workorders in plan.items():
+            merged.setdefault(action, dict()).update(workorders)
+    return merged
@@ -5,15 +5,27 @@ import json
 import logging
 import logging.handlers
 import os
-import re
-
-from requests import Session
-from requests.cookies import cookiejar_from_dict, RequestsCookieJar
-from typing import Any, Dict
+import shutil
+import sys
+import tempfile
+import time
+
+from collections.abc import MutableMapping
+
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
+from PySide6.QtCore import QMutex
+from requests import HTTPError, Session
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Set, Tuple
 from urllib.parse import quote
 
 from .aim_session import AimSession
-from .settings import CONFIG, COOKIE_FILE
+from .cookie_store import AUTH_FAILURES, CredentialManager
+from .response_cache import ResponseCache
+from .session_pool import _free_port
+from .settings import CONFIG
 
 logger = logging.getLogger(__name__)
 if CONFIG.debug:
@@ -22,9 +34,13 @@ if CONFIG.debug:
 AIM_BASE = "https://washington.assetworks.hosting/fmax/"
 AIM_HOME = AIM_BASE + "screen/WORKDESK"
 AIM_API = AIM_BASE + "api/v3/iq-reports/custom-resource?"
-AIM_API_PHASE_SEARCH = (
-    AIM_API + "filterName={}&screenName=PHASE_SEARCH&value&rowLimit=1000"
-)
+AIM_API_PHASE_SEARCH = AIM_API + "filterName={}&screenName=PHASE_SEARCH&value"
+AIM_API_PAGE = "&rowLimit={}&startRow={}"
+PAGE_SIZE = 500
+# rowLimit of the single request made when AiM ignores startRow
+UNPAGED_ROW_LIMIT = 10000
+# proposals per shop assignment request, keeps urls well under server limits
+ASSIGNMENT_CHUNK = 50
 AIM_API_SHOP_ASSIGNMET_SEARCH = (
     AIM_API + "tableName=AePProS&proposal={}&value&rowLimit=10000"
 )
@@ -41,6 +57,9 @@ WO_FIELDS = (
 
 HOME = os.path.expanduser("~")
 
+# connections kept open per host, enough for every fetch query at once
+POOL_SIZE = 8
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
@@ -48,22 +67,110 @@ HEADERS = {
     "Connection": "keep-alive",
 }
 
-ALLOWABLE_DAYS = {
-    "200 URGENT": datetime.timedelta(1),
-    "300 HIGH": datetime.timedelta(7),
-    "400 ROUTINE": datetime.timedelta(25),
-}
+# stands in for a field that has not been set
+_UNSET = object()
 
 
-class Workorder(dict):
+class Workorder(MutableMapping):
+    """
+    One workorder phase, keeping only the fields the daemon uses.
+
+    Reads like a dict that returns "" for missing fields. entDate is parsed
+    once on the way in and kept as the "entered" datetime, and repeated
+    codes are interned so rows share one string each.
+    """
+
+    FIELDS = WO_FIELDS + ("primary", "shopPerson", "shopPeople", "HRC")
+    # the fields triage, jobs and the GUI act on, see fingerprint
+    COMPARED = ("description", "priCode", "statusCode", "entered")
+    # the same, set by join_assignments on active work only
+    COMPARED_ASSIGNMENTS = ("primary", "shopPerson")
+    _STORED = tuple(f for f in FIELDS if f != "entDate") + ("entered",)
+    __slots__ = _STORED + ("_fingerprint",)
+    _SLOTS = frozenset(_STORED)
+    _INTERNED = frozenset(("sortCode", "priCode", "statusCode", "bldg"))
+
+    def __init__(self, fields: Mapping = (), **kwargs: Any) -> None:
+        for k, v in dict(fields, **kwargs).items():
+            if k in self.FIELDS:
+                self[k] = v
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        """Identity of the phase, stable across fetches"""
+        return (getattr(self, "proposal", ""), getattr(self, "sortCode", ""))
+
+    @property
+    def fingerprint(self) -> int:
+        """
+        Hash of the COMPARED and COMPARED_ASSIGNMENTS fields, equal for
+        records the daemon treats the same. Kept until one of the fields changes, so a record reused from
+        RESPONSES is not hashed again.
+        """
+        h = getattr(self, "_fingerprint", None)
+        if h is None:
+            try:
+                values = _compared(self)
+            except AttributeError:
+                values = tuple(getattr(self, f, None) for f in self.COMPARED)
+            h = self._fingerprint = hash(
+                (values, getattr(self, "primary", None), getattr(self, "shopPerson", None))
+            )
+        return h
 
     def __getitem__(self, key: Any) -> Any:
-        if key not in self.keys():
-            return ""
-        return super().__getitem__(key)
+        if key == "entDate":
+            entered = getattr(self, "entered", None)
+            return entered.isoformat() if entered else ""
+        if key in self._SLOTS:
+            return getattr(self, key, "")
+        return ""
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == "entDate":
+            key = "entered"
+            try:
+                value = datetime.datetime.fromisoformat(value).astimezone()
+            except (TypeError, ValueError):
+                value = None
+        elif key not in self._SLOTS:
+            raise KeyError(f"Workorder has no field {key!r}")
+        elif key in self._INTERNED and isinstance(value, str):
+            value = sys.intern(value)
+        if getattr(self, key, _UNSET) != value:
+            setattr(self, key, value)
+            self._fingerprint = None
+
+    def __delitem__(self, key: str) -> None:
+        if key == "entDate":
+            key = "entered"
+        if key not in self._SLOTS:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+        self._fingerprint = None
+
+    def __contains__(self, key: Any) -> bool:
+        if key == "entDate":
+            key = "entered"
+        return key in self._SLOTS and hasattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        for k in self.FIELDS:
+            if hasattr(self, "entered" if k == "entDate" else k):
+                yield k
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
 
     def __repr__(self) -> str:
-        return f"Workorder:\n{json.dumps(self, indent=2)}"
+        return f"Workorder:\n{json.dumps(dict(self), indent=2)}"
+
+
+# fetches every Workorder.COMPARED field in one call, raising if any is unset
+_compared = attrgetter(*Workorder.COMPARED)
 
 
 def limit_fields(workorder: Workorder, *fields: str) -> Dict[str, Any]:
@@ -74,120 +181,256 @@ def limit_fields(workorder: Workorder, *fields: str) -> Dict[str, Any]:
 def _get_new_cookies(netid: str = CONFIG.netid) -> dict:
     cookies = {}
     logger.debug("fetching new cookies")
-    with AimSession(netid=netid) as aim:
-        if CONFIG.debug:
-            aim.minimize_window()
-        for cookie in aim.get_cookies():
-            cookies[cookie["name"]] = cookie["value"]
+    # the session pool may hold the configured profile and port open
+    profile = tempfile.mkdtemp(prefix="aimhelper-")
+    try:
+        with AimSession(netid=netid, profile=profile, port=_free_port()) as aim:
+            if CONFIG.debug:
+                aim.minimize_window()
+            for cookie in aim.get_cookies():
+                cookies[cookie["name"]] = cookie["value"]
+    finally:
+        shutil.rmtree(profile, ignore_errors=True)
     return cookies
 
 
+CREDENTIALS = CredentialManager(_get_new_cookies, AIM_HOME)
+
+
 def get_cookies() -> RequestsCookieJar:
-    cookies = {}
-    if os.path.exists(COOKIE_FILE):
-        with open(COOKIE_FILE) as f:
-            cookies = json.load(f)
-        s = Session()
-        r = s.get(AIM_HOME, cookies=cookies, allow_redirects=False)
-        if r.status_code == 200:
-            return cookiejar_from_dict(cookies)
+    return CREDENTIALS.cookies()
+
+
+def new_session() -> Session:
+    """requests.Session whose connection pool can serve concurrent queries"""
+    s = Session()
+    s.mount("https://", HTTPAdapter(pool_maxsize=POOL_SIZE))
+    return s
+
+
+def authenticate(s: Session) -> None:
+    """Load valid AiM cookies into a session"""
+    s.cookies = get_cookies()
+
+
+def _api_get(s: Session, url: str, headers: dict | None = None):
+    """GET an API url, renewing the cookies and retrying once if AiM refuses them"""
+    r = s.get(url, headers=headers, allow_redirects=False)
+    if r.status_code in AUTH_FAILURES:
+        logger.debug(f"Response code:{r.status_code}, renewing cookies")
+        CREDENTIALS.invalidate()
+        s.cookies = get_cookies()
+        r = s.get(url, headers=headers, allow_redirects=False)
+    CREDENTIALS.update(r.cookies)
+    return r
+
+
+RESPONSES = ResponseCache()
+# cleared by iter_workorders the first time AiM ignores startRow
+_paging_supported = True
+
+
+def _cached_get(s: Session, url: str, parse: Callable[[dict], Any]) -> Any:
+    """
+    GET an API url through RESPONSES, decoding and parsing the body only
+    when it changed. Raises HTTPError if AiM did not answer with the data,
+    so a failed page is never mistaken for the end of the results.
+    """
+    r = _api_get(s, url, RESPONSES.validators(url))
+    logger.debug(f"Respose code:{r.status_code}")
+    if r.status_code == 304:
+        value, _ = RESPONSES.lookup(url, r)
+        if value is not None:
+            return value
+        # evicted since the request was made
+        r = _api_get(s, url)
+    if r.status_code != 200:
+        raise HTTPError(f"{r.status_code} from {url}", response=r)
+    value, digest = RESPONSES.lookup(url, r)
+    if value is None:
+        value = parse(r.json())
+        RESPONSES.put(url, r, digest, value)
+    return value
+
+
+def _parse_workorders(data: dict) -> List[Workorder]:
+    return [Workorder(**w["fields"]) for w in data["ResultSet"]["Results"]]
 
-    cookies = _get_new_cookies()
-    with open(COOKIE_FILE, "w") as f:
-        json.dump(cookies, f)
-    return cookiejar_from_dict(cookies)
 
+def _parse_assignments(data: dict) -> List[dict]:
+    return [p["fields"] for p in data["ResultSet"]["Results"]]
 
-def save_cookies(cookies: RequestsCookieJar):
-    cookie_dict = {k: v for k, v in cookies.items()}
-    with open(COOKIE_FILE, "w") as f:
-        json.dump(cookie_dict, f)
 
+def iter_workorders(
+    query: str,
+    s: Session = Session(),
+    authenticated: bool = False,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[Workorder]:
+    """Stream workorders from AiM, one page of results at a time
 
-def get_workorders(query: str, s: Session = Session()) -> list[Workorder]:
+    Pages go through RESPONSES, so a page identical to the last fetch of
+    it yields the same Workorder objects without being decoded again.
+    Queries are not cut off at a fixed row limit. If AiM turns out to
+    ignore startRow, the rest comes from one request of UNPAGED_ROW_LIMIT
+    rows, and later calls make only that request.
+
+    Args:
+        query (str): Name of personal querry
+        s (Session, optional): requests.Session object. Defaults to new Session.
+        authenticated (bool, optional): s already holds valid cookies. Defaults to False.
+        page_size (int, optional): rows per request. Defaults to PAGE_SIZE.
+
+    Yields:
+        Workorder:
+
+    Raises:
+        HTTPError: a page could not be fetched
+    """
+    query = quote(query)
+
+    global _paging_supported
+
+    if not authenticated:
+        authenticate(s)
+    start = 0
+    seen: Set[Tuple[str, str]] = set()
+    while _paging_supported:
+        url = AIM_API_PHASE_SEARCH.format(query) + AIM_API_PAGE.format(page_size, start)
+        logger.debug(f"Fetching {url}")
+        results = _cached_get(s, url, _parse_workorders)
+        if not results:
+            return
+        # a server that ignores startRow would send the same page forever
+        if start and results[0].key in seen:
+            logger.warning("AiM ignores startRow, fetching queries in one request")
+            _paging_supported = False
+            break
+        seen = {w.key for w in results}
+        yield from results
+        if len(results) < page_size:
+            return
+        start += len(results)
+
+    url = AIM_API_PHASE_SEARCH.format(query) + AIM_API_PAGE.format(UNPAGED_ROW_LIMIT, 0)
+    logger.debug(f"Fetching {url}")
+    results = _cached_get(s, url, _parse_workorders)
+    if len(results) >= UNPAGED_ROW_LIMIT:
+        logger.warning(f"{query} may be cut off at {UNPAGED_ROW_LIMIT} rows")
+    # rows of the first page have been yielded already
+    yield from (w for w in results if w.key not in seen)
+
+
+def get_workorders(
+    query: str, s: Session = Session(), authenticated: bool = False
+) -> list[Workorder]:
     """Get a list of workorders from AiM using API call
 
     Args:
         query (str): Name of personal querry
         s (Session, optional): requests.Session object. Defaults to new Session.
+        authenticated (bool, optional): s already holds valid cookies. Defaults to False.
 
     Returns:
         list[Workorder]:
     """
-    query = quote(query)
+    return list(iter_workorders(query, s, authenticated))
 
-    s.cookies = get_cookies()
-    r = s.get(AIM_HOME, allow_redirects=False)
-    if r.cookies:
-        s.cookies = r.cookies
-        save_cookies(r.cookies)
-    logger.debug(f"Fetching {AIM_API_PHASE_SEARCH.format(query)}")
-    r = s.get(AIM_API_PHASE_SEARCH.format(query))
-    logger.debug(f"Respose code:{r.status_code}")
-    if r.status_code != 200:
-        return list()
-    workorders = [
-        Workorder(**workorder["fields"])
-        for workorder in r.json()["ResultSet"]["Results"]
-    ]
-    return workorders
-
-
-def is_past_due(workorder: Workorder) -> bool:
-    if workorder["priCode"] not in ALLOWABLE_DAYS.keys():
-        return False
-    created = datetime.datetime.fromisoformat(workorder["entDate"])
-    if (
-        datetime.datetime.today().astimezone() - created
-        > ALLOWABLE_DAYS[workorder["priCode"]]
-    ):
-        return True
-    return False
-
-
-def has_no_hrc(workorder: Workorder) -> bool:
-    r = re.compile(r"hrc( )?[0-9]{3}", re.IGNORECASE | re.MULTILINE)
-    return not r.search(workorder["description"])
-
-
-def has_keyword_regex(workorder: Workorder, keyword: str, ignore_case=True) -> bool:
-    if ignore_case:
-        return re.search(
-            keyword, workorder["description"], re.IGNORECASE | re.MULTILINE
-        )
-    return bool(re.search(keyword, workorder["description"]))
-
-
-def guess_hrc(workorder: Workorder) -> str:
-    txt = workorder["description"]
-    if re.search(
-        r"\b(animal(s)?|primate|lab|fume(hood)?)\b", txt, re.IGNORECASE | re.MULTILINE
-    ):
-        return "107"
-    if re.search(r"\b(light(s)?)\b", txt, re.IGNORECASE | re.MULTILINE):
-        return "117"
-    if re.search(r"\b(roof(top)?)\b", txt, re.IGNORECASE | re.MULTILINE):
-        return "109"
-    if re.search("lift station", txt, re.IGNORECASE | re.MULTILINE):
-        return "113"
-    return "110"
 
+class AssignmentCache(object):
+    """Shop assignments per (proposal, sortCode), reused for ttl seconds"""
 
-def get_shop_assignments(
-    workorders: list[Workorder], s: Session = Session()
-) -> list[dict]:
-    s.cookies = get_cookies()
-    r = s.get(AIM_HOME, allow_redirects=False)
-    if r.cookies:
-        s.cookies = r.cookies
-        save_cookies(r.cookies)
+    def __init__(self, ttl: int = 0) -> None:
+        self.ttl = ttl or CONFIG.assignment_ttl
+        self.__entries: Dict[Tuple[str, str], Tuple[float, List[dict]]] = dict()
+        self.mutex = QMutex()
 
-    proposals = ",".join([w["proposal"] for w in workorders])
-    logger.debug(f"Fetching {AIM_API_SHOP_ASSIGNMET_SEARCH.format(proposals)}")
+    def missing(self, keys: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """Keys with no fresh entry. Expired entries are dropped"""
+        now = time.monotonic()
+        self.mutex.lock()
+        for key in [
+            k for k, (t, _) in self.__entries.items() if now - t > self.ttl
+        ]:
+            del self.__entries[key]
+        r = {k for k in keys if k not in self.__entries}
+        self.mutex.unlock()
+        return r
 
-    r = s.get(AIM_API_SHOP_ASSIGNMET_SEARCH.format(proposals))
-    logger.debug(f"Respose code:{r.status_code}")
+    def store(self, keys: Iterable[Tuple[str, str]], assignments: List[dict]) -> None:
+        """Cache the assignments returned for a request, and record requested phases that had none"""
+        now = time.monotonic()
+        grouped = {k: list() for k in keys}
+        for a in assignments:
+            grouped.setdefault((a["proposal"], a["sortCode"]), list()).append(a)
+        self.mutex.lock()
+        for key, rows in grouped.items():
+            self.__entries[key] = (now, rows)
+        self.mutex.unlock()
 
-    if r.status_code != 200:
-        return list()
-    return [p["fields"] for p in r.json()["ResultSet"]["Results"]]
+    def get(self, keys: Iterable[Tuple[str, str]]) -> List[dict]:
+        self.mutex.lock()
+        r = [a for k in keys if k in self.__entries for a in self.__entries[k][1]]
+        self.mutex.unlock()
+        return r
+
+
+ASSIGNMENTS = AssignmentCache()
+
+
+def _fetch_assignments(proposals: List[str], s: Session) -> List[dict]:
+    url = AIM_API_SHOP_ASSIGNMET_SEARCH.format(",".join(proposals))
+    logger.debug(f"Fetching {url}")
+    return _cached_get(s, url, _parse_assignments)
+
+
+def get_shop_assignments(
+    workorders: list[Workorder], s: Session = Session(), authenticated: bool = False
+) -> list[dict]:
+    """Get shop assignments for a list of workorders
+
+    Only phases without a fresh cached entry are looked up, in chunks of
+    ASSIGNMENT_CHUNK proposals fetched concurrently.
+    """
+    keys = [w.key for w in workorders]
+    missing = ASSIGNMENTS.missing(keys)
+    proposals = sorted({p for p, _ in missing})
+    if proposals:
+        if not authenticated:
+            authenticate(s)
+        chunks = [
+            proposals[i : i + ASSIGNMENT_CHUNK]
+            for i in range(0, len(proposals), ASSIGNMENT_CHUNK)
+        ]
+        with ThreadPoolExecutor(max_workers=min(len(chunks), POOL_SIZE)) as pool:
+            results = pool.map(lambda c: _fetch_assignments(c, s), chunks)
+            for chunk, assignments in zip(chunks, results):
+                chunk = set(chunk)
+                ASSIGNMENTS.store((k for k in missing if k[0] in chunk), assignments)
+    logger.debug(f"{len(keys) - len(missing)} of {len(keys)} assignments cached")
+    return ASSIGNMENTS.get(keys)
+
+
+def index_assignments(assignments: list[dict]) -> Dict[Tuple[str, str], List[dict]]:
+    """Group assignment rows by (proposal, sortCode)"""
+    index = dict()
+    for a in assignments:
+        index.setdefault((a["proposal"], a["sortCode"]), list()).append(a)
+    return index
+
+
+def join_assignments(workorders: list[Workorder], assignments: list[dict]) -> None:
+    """Add shop assignments to workorders, in a single pass over each list
+
+    Sets "primary" to the primary shop person, "shopPeople" to the other
+    assigned shop people and, for phases with no primary, "shopPerson" to
+    the first of them, which is who "Fix missing primary" promotes.
+    """
+    index = index_assignments(assignments)
+    for w in workorders:
+        rows = index.get(w.key, ())
+        primary = next((a["shopPerson"] for a in rows if a["primaryYn"] == "Y"), "")
+        secondary = tuple(a["shopPerson"] for a in rows if a["primaryYn"] == "N")
+        w["primary"] = primary
+        w["shopPeople"] = secondary
+        w["shopPerson"] = secondary[0] if secondary and not primary else ""
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, Tuple
+
+from .worklist import Workorder
+
+Key = Tuple[str, str]
+
+
+class WorklistDiff(object):
+    """Records added, modified and removed between two fetches, by Workorder.key"""
+
+    __slots__ = ("added", "modified", "removed")
+
+    def __init__(self) -> None:
+        self.added: Dict[Key, Workorder] = dict()
+        self.modified: Dict[Key, Workorder] = dict()
+        self.removed: Dict[Key, Workorder] = dict()
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.modified or self.removed)
+
+    def __repr__(self) -> str:
+        return (
+            f"WorklistDiff(added={len(self.added)}, modified={len(self.modified)},"
+            f" removed={len(self.removed)})"
+        )
+
+    @property
+    def changed(self) -> Dict[Key, Workorder]:
+        """Added and modified records, the ones worth looking at again"""
+        return {**self.added, **self.modified}
+
+    def update(self, other: WorklistDiff) -> None:
+        self.added.update(other.added)
+        self.modified.update(other.modified)
+        self.removed.update(other.removed)
+
+
+class ChangeTracker(object):
+    """
+    Remembers the last fetch of one query and reports what the next one
+    changed, comparing records by Workorder.fingerprint. Records reused from the
+    response cache keep their fingerprint, so an unchanged page costs a
+    lookup per row.
+    """
+
+    def __init__(self) -> None:
+        self._previous: Dict[Key, Tuple[int, Workorder]] = dict()
+
+    def __len__(self) -> int:
+        return len(self._previous)
+
+    def reset(self) -> None:
+        """Forget the last fetch, so the next one is reported as all added"""
+        self._previous = dict()
+
+    def update(self, workorders: Iterable[Workorder]) -> WorklistDiff:
+        diff = WorklistDiff()
+        previous = self._previous
+        current = dict()
+        for w in workorders:
+            key = w.key
+            h = w.fingerprint
+            current[key] = (h, w)
+            seen = previous.get(key)
+            if seen is None:
+                diff.added[key] = w
+            elif seen[0] != h:
+                diff.modified[key] = w
+        for key, (_, w) in previous.items():
+            if key not in current:
+                diff.removed[key] = w
+        self._previous = current
+        return diff
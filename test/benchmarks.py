@@ -0,0 +1,188 @@
+"""
+Micro benchmarks for the fetch cycle's data handling.
+Run from the repository root: python test/benchmarks.py
+"""
+import gc
+import os
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aim_helper.triage import TriageEngine  # noqa: E402
+from aim_helper.worklist import Workorder, join_assignments  # noqa: E402
+from aim_helper.worklist_diff import ChangeTracker  # noqa: E402
+
+PEOPLE = ("819005722", "846003465", "847008742", "850003059", "871004976")
+
+
+def make_worklist(rows):
+    return [
+        Workorder(proposal=str(100000 + i // 2), sortCode=str(1 + i % 2).zfill(3))
+        for i in range(rows)
+    ]
+
+
+def make_assignments(workorders):
+    assignments = []
+    for w in workorders:
+        for n in range(random.randint(0, 2)):
+            assignments.append(
+                dict(
+                    proposal=w["proposal"],
+                    sortCode=w["sortCode"],
+                    shopPerson=random.choice(PEOPLE),
+                    primaryYn="Y" if n == 0 and random.random() < 0.7 else "N",
+                )
+            )
+    random.shuffle(assignments)
+    return assignments
+
+
+def nested_join(workorders, assignments):
+    """The join as it was before join_assignments, for comparison"""
+    for w in workorders:
+        for a in assignments:
+            if a["proposal"] == w["proposal"] and a["sortCode"] == w["sortCode"]:
+                if a["primaryYn"] == "Y":
+                    w["primary"] = a["shopPerson"]
+                    break
+                if a["primaryYn"] == "N":
+                    w["shopPerson"] = a["shopPerson"]
+                    break
+
+
+class DictWorkorder(dict):
+    """Workorder as it was before __slots__, for comparison"""
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            return ""
+        return super().__getitem__(key)
+
+
+def make_api_rows(rows):
+    """Rows as PHASE_SEARCH returns them, including fields the daemon ignores"""
+    return [
+        dict(
+            proposal=str(100000 + i),
+            sortCode="001",
+            description=f"replace outlet in room {i} HRC110",
+            bldg=random.choice(("0001", "0002", "0142", "1163")),
+            statusCode="NEW",
+            priCode=random.choice(("200 URGENT", "300 HIGH", "400 ROUTINE")),
+            entDate=(
+                datetime.now().astimezone() - timedelta(minutes=random.randint(0, 10**6))
+            ).isoformat(),
+            contactName="Someone Else",
+            contactPhone="206-555-0100",
+            locId=str(i),
+            shop="17 ELECTRIC",
+            craftCode="ELEC",
+            editClerk="AIMUSER",
+            editDate="2024-05-02T08:30:00-07:00",
+        )
+        for i in range(rows)
+    ]
+
+
+def bench_workorder():
+    print("workorder memory and field access")
+    rows = make_api_rows(10000)
+    for name, cls in (("dict", DictWorkorder), ("slots", Workorder)):
+        tracemalloc.start()
+        workorders = [cls(**row) for row in rows]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        access = min(
+            timeit.repeat(
+                lambda: [(w["priCode"], w["description"], w["HRC"]) for w in workorders],
+                number=10,
+            )
+        )
+        print(
+            f"  {name:5}: {size / 1024:8.0f} KiB for {len(rows)} rows,"
+            f" 3 reads x {len(rows)} rows {access * 100:6.1f} ms"
+        )
+
+
+def bench_triage():
+    print("triage one fetch")
+    engine = TriageEngine()
+    last_run = datetime.now().astimezone() - timedelta(minutes=5)
+    for rows in (2000, 10000, 50000):
+        sources = {
+            source: [Workorder(**row) for row in make_api_rows(rows)]
+            for source in ("new", "active", "hold")
+        }
+        gc.collect()
+        plan = min(timeit.repeat(lambda: engine.plan(sources, last_run), number=1, repeat=5))
+        print(f"  {rows:6} rows per query: {plan * 1000:8.1f} ms")
+
+
+def bench_steady_state():
+    print("fetch cycle for the New query, diff then plan only what changed")
+    engine = TriageEngine()
+    last_run = datetime.now().astimezone() - timedelta(minutes=5)
+    for rows in (2000, 10000, 50000):
+        api_rows = make_api_rows(rows)
+        previous = [Workorder(**row) for row in api_rows]
+        edited = set(random.sample(range(rows), rows // 100))
+
+        full = min(
+            timeit.repeat(lambda: engine.plan({"new": previous}, last_run), number=1)
+        )
+        parsed = diff = delta = float("inf")
+        for _ in range(5):
+            tracker = ChangeTracker()
+            tracker.update(previous)
+            # 1% edited, every page parsed again into new records
+            current = [Workorder(**row) for row in api_rows]
+            for i in edited:
+                current[i]["description"] += " (edited)"
+            gc.collect()
+            start = time.perf_counter()
+            changed = tracker.update(current).changed
+            middle = time.perf_counter()
+            engine.plan({"new": changed.values()}, last_run)
+            parsed = min(parsed, middle - start)
+            delta = min(delta, time.perf_counter() - middle)
+            # nothing changed, every page's records reused from the response cache
+            gc.collect()
+            start = time.perf_counter()
+            tracker.update(current)
+            diff = min(diff, time.perf_counter() - start)
+        print(
+            f"  {rows:6} rows: full plan {full * 1000:7.1f} ms"
+            f"  1% edited: diff {parsed * 1000:6.1f} ms + plan {delta * 1000:4.1f} ms"
+            f"  unchanged: diff {diff * 1000:6.1f} ms"
+        )
+
+
+def bench_join():
+    print("join workorders and assignments")
+    for rows in (1000, 2000, 10000, 50000):
+        workorders = make_worklist(rows)
+        assignments = make_assignments(workorders)
+        new = min(
+            timeit.repeat(lambda: join_assignments(workorders, assignments), number=1)
+        )
+        if rows <= 2000:
+            old = timeit.timeit(lambda: nested_join(workorders, assignments), number=1)
+            old = f"{old * 1000:10.1f} ms"
+        else:
+            old = f"{'skipped':>13}"
+        print(f"  {rows:6} rows: nested {old}  indexed {new * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    random.seed(0)
+    bench_workorder()
+    bench_triage()
+    bench_steady_state()
+    bench_join()
@@ -0,0 +1,70 @@
+import json
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class _DummyAimApiHandler(BaseHTTPRequestHandler):
+    def _phase(self):
+        parts = self.path.strip("/").split("/")
+        if parts[:3] != ["api", "v3", "phases"] or len(parts) != 5:
+            return None
+        return tuple(parts[3:])
+
+    def _reply(self, code, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        key = self._phase()
+        if key not in self.server.phases:
+            return self._reply(404)
+        self._reply(200, {"fields": self.server.phases[key]})
+
+    def do_PATCH(self):
+        key = self._phase()
+        if key not in self.server.phases:
+            return self._reply(404)
+        length = int(self.headers.get("Content-Length", 0))
+        fields = json.loads(self.rfile.read(length))["fields"]
+        if key not in self.server.ignored:
+            self.server.phases[key].update(fields)
+        self._reply(200, {"fields": self.server.phases[key]})
+
+    def log_message(self, *args):
+        pass
+
+
+class DummyAimApi(ThreadingHTTPServer):
+    """
+    Standin for the AiM phase REST API, for use with PhaseApi(base=server.base)
+
+    Use as a context manager to serve from a background thread.
+    """
+
+    def __init__(self, phases: dict = None) -> None:
+        super().__init__(("127.0.0.1", 0), _DummyAimApiHandler)
+        # (proposal, sortCode) -> phase fields
+        self.phases = phases or {}
+        # phases that accept a PATCH but keep their fields, like a silently
+        # ignored write
+        self.ignored = set()
+        self._thread = None
+
+    @property
+    def base(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/"
+
+    def __enter__(self):
+        self._thread = Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, ex_type, ex_val, ex_trace):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
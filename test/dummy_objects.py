@@ -11,7 +11,7 @@ from PyQt6.QtCore import (
     pyqtSlot,
 )
 
-from ..aim_helper.aim_daemon import Job, JobQue, Runnable
+from ..aim_helper.aim_daemon import Job, JobScheduler, Runnable
 
 TEST_FILE = os.path.join(os.path.split(__file__)[0], "test.csv")
 
@@ -33,7 +33,7 @@ class DummyDaemon(QObject):
         super().__init__()
         self.data = []
         self.active = False
-        self.jobs = JobQue()
+        self.jobs = JobScheduler()
         self.timer = QTimer()
         self.timer.timeout.connect(self.test_work)
 
@@ -74,3 +74,4 @@ class DummySession(QObject):
 
     def __exit__(self, ex_type, ex_val, ex_trace):
         return True
+
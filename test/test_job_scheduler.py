@@ -0,0 +1,80 @@
+import time
+import unittest
+
+from aim_helper.aim_daemon import Job, JobPriority, JobScheduler
+
+
+def noop(data):
+    pass
+
+
+def _job(key, data=None, priority=JobPriority.BACKGROUND):
+    return Job(noop, data, priority=priority, key=key)
+
+
+class JobSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.jobs = JobScheduler()
+
+    def test_priority_order(self):
+        self.jobs.add_job(_job("background 1"))
+        self.jobs.add_job(_job("user", priority=JobPriority.USER))
+        self.jobs.add_job(_job("background 2"))
+        self.jobs.add_job(_job("interactive", priority=JobPriority.INTERACTIVE))
+        popped = [self.jobs.pop().key for _ in range(4)]
+        self.assertEqual(
+            popped, ["interactive", "user", "background 1", "background 2"]
+        )
+        self.assertIsNone(self.jobs.pop())
+
+    def test_merge_replaces_data(self):
+        self.assertTrue(self.jobs.add_job(_job("a", 1)))
+        self.assertFalse(self.jobs.add_job(_job("a", 2)))
+        self.assertEqual(len(self.jobs), 1)
+        self.assertEqual(self.jobs.merged, 1)
+        self.assertEqual(self.jobs.pop().data, 2)
+
+    def test_merge_keeps_more_urgent_priority(self):
+        self.jobs.add_job(_job("a", 1, JobPriority.USER))
+        self.jobs.add_job(_job("b", priority=JobPriority.USER))
+        # a less urgent duplicate keeps its place in the USER class
+        self.jobs.add_job(_job("a", 2))
+        self.assertEqual(self.jobs.depth()["USER"], 2)
+        job = self.jobs.pop()
+        self.assertEqual((job.key, job.data), ("a", 2))
+        self.assertEqual(job.priority, JobPriority.USER)
+
+    def test_merge_promotes(self):
+        self.jobs.add_job(_job("a", 1))
+        self.jobs.add_job(_job("b", priority=JobPriority.USER))
+        self.jobs.add_job(_job("a", 2, JobPriority.INTERACTIVE))
+        self.assertEqual([self.jobs.pop().key for _ in range(2)], ["a", "b"])
+        self.assertIsNone(self.jobs.pop())
+
+    def test_running_key_dropped(self):
+        self.jobs.add_job(_job("a"))
+        job = self.jobs.pop()
+        self.assertFalse(self.jobs.add_job(_job("a")))
+        self.assertFalse(self.jobs)
+        self.jobs.done(job)
+        self.assertTrue(self.jobs.add_job(_job("a")))
+        self.assertEqual(len(self.jobs), 1)
+
+    def test_delayed_pop(self):
+        self.jobs.add_job(_job("later"), delay=0.2)
+        self.jobs.add_job(_job("now"))
+        self.assertEqual(self.jobs.pop().key, "now")
+        self.assertIsNone(self.jobs.pop())
+        start = time.monotonic()
+        job = self.jobs.pop(timeout=10)
+        self.assertEqual(job.key, "later")
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+
+    def test_pop_times_out(self):
+        start = time.monotonic()
+        self.assertIsNone(self.jobs.pop(timeout=50))
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import time
+import unittest
+
+from aim_helper.aim_daemon import AimProcessor
+from aim_helper.job_store import FAILED, QUEUED, RUNNING, JobStore
+
+DAY = 24 * 60 * 60
+
+
+def _record(key, action="cancel_workorder", retryable=True):
+    return dict(
+        key=key,
+        action=action,
+        http_action="cancel_workorder_http",
+        data=dict(workorder=dict(proposal=key[1], sortCode=key[2])),
+        description=f"{key[1]} -- {key[2]}",
+        priority=2,
+        retryable=retryable,
+    )
+
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = JobStore(":memory:")
+        self.addCleanup(self.store.close)
+
+    def test_pending_resets_running(self):
+        self.store.put([_record(("CANCEL", "100", "001"))])
+        self.store.put([_record(("CANCEL", "101", "001"))])
+        self.store.set_state(("CANCEL", "101", "001"), RUNNING)
+        pending = self.store.pending()
+        self.assertEqual(
+            [(r["key"], r["state"]) for r in pending],
+            [(("CANCEL", "100", "001"), QUEUED), (("CANCEL", "101", "001"), RUNNING)],
+        )
+        self.assertEqual(self.store.counts(), {QUEUED: 2})
+
+    def test_put_keeps_running_job(self):
+        key = ("CANCEL", "100", "001")
+        self.store.put([_record(key)])
+        self.store.set_state(key, RUNNING)
+        self.store.put([_record(key)])
+        self.assertEqual(self.store.counts(), {RUNNING: 1})
+
+    def test_complete_journals(self):
+        key = ("CANCEL", "100", "001")
+        self.store.put([_record(key)])
+        self.store.complete(key)
+        self.assertEqual(self.store.pending(), [])
+        self.assertEqual(self.store.journaled(), {key})
+
+    def test_journal_expires(self):
+        old, new = ("CANCEL", "100", "001"), ("CANCEL", "101", "001")
+        self.store.complete(old)
+        self.store.complete(new)
+        self.store.db.execute(
+            "UPDATE journal SET done = ? WHERE key = ?",
+            (time.time() - 2 * DAY, '["CANCEL", "100", "001"]'),
+        )
+        self.assertEqual(self.store.journaled(days=1), {new})
+        self.assertEqual(self.store.journaled(days=3), {old, new})
+        self.store.prune(1)
+        self.assertEqual(self.store.journaled(days=3), {new})
+
+    def test_failed(self):
+        key = ("CANCEL", "100", "001")
+        self.store.put([_record(key)])
+        self.store.set_state(key, FAILED, "could not cancel 100-001")
+        (record,) = self.store.failed()
+        self.assertEqual(record["key"], key)
+        self.assertEqual(record["error"], "could not cancel 100-001")
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.store = JobStore(":memory:")
+        self.addCleanup(self.store.close)
+        self.processor = AimProcessor(self.store)
+        self.processor.watchdog.stop()
+        self.resumed = list()
+        self.processor.add_jobs = self.resumed.extend
+        self.dead_letters = list()
+        self.processor.dead_letter.connect(self.dead_letters.append)
+
+    def test_resume(self):
+        queued = ("CANCEL", "100", "001")
+        running = ("CANCEL", "101", "001")
+        self.store.put([_record(queued), _record(running)])
+        self.store.set_state(running, RUNNING)
+        self.processor.resume()
+        self.assertEqual([j.key for j in self.resumed], [queued, running])
+        job = self.resumed[0]
+        self.assertEqual(job.action.__name__, "cancel_workorder")
+        self.assertEqual(job.data["proposal"], "100")
+        self.assertEqual(self.dead_letters, [])
+
+    def test_interrupted_unsafe_job_fails(self):
+        # may have finished before the app stopped, so it is not run again
+        key = ("create_workorder", "100", "001")
+        self.store.put([_record(key, "create_workorder", retryable=False)])
+        self.store.set_state(key, RUNNING)
+        self.processor.resume()
+        self.assertEqual(self.resumed, [])
+        (failed,) = self.store.failed()
+        self.assertEqual(failed["error"], "interrupted, check AiM")
+        self.assertEqual(self.dead_letters, ["100 -- 001: interrupted, check AiM"])
+
+    def test_queued_unsafe_job_resumes(self):
+        key = ("create_workorder", "100", "001")
+        self.store.put([_record(key, "create_workorder", retryable=False)])
+        self.processor.resume()
+        self.assertEqual([j.key for j in self.resumed], [key])
+        self.assertFalse(self.resumed[0].retryable)
+
+    def test_unknown_action_fails(self):
+        key = ("CANCEL", "100", "001")
+        self.store.put([_record(key, "no_such_action")])
+        self.processor.resume()
+        self.assertEqual(self.resumed, [])
+        (failed,) = self.store.failed()
+        self.assertTrue(failed["error"].startswith("can't resume"))
+
+
+if __name__ == "__main__":
+    unittest.main()
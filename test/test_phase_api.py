@@ -0,0 +1,69 @@
+import unittest
+
+from unittest import mock
+
+from requests.cookies import RequestsCookieJar
+
+from aim_helper.phase_api import PhaseApi
+from dummy_api import DummyAimApi
+
+
+def _phases():
+    return {
+        ("100", "001"): {
+            "statusCode": "OPEN",
+            "priCode": "300 HIGH",
+            "description": "replace ballast",
+        },
+    }
+
+
+class PhaseApiTest(unittest.TestCase):
+    def setUp(self):
+        # never log in to the real AiM for cookies
+        patcher = mock.patch(
+            "aim_helper.phase_api.get_cookies", return_value=RequestsCookieJar()
+        )
+        self.get_cookies = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = DummyAimApi(_phases())
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.api = PhaseApi(base=self.server.base)
+        self.phase = self.server.phases[("100", "001")]
+
+    def test_change_status(self):
+        self.assertTrue(self.api.change_status("100", "001", "CANCEL"))
+        self.assertEqual(self.phase["statusCode"], "CANCEL")
+        self.assertEqual(self.phase["priCode"], "300 HIGH")
+
+    def test_hold_also_deprioritizes(self):
+        self.assertTrue(self.api.change_status("100", "001", "HOLD"))
+        self.assertEqual(self.phase["statusCode"], "HOLD")
+        self.assertEqual(self.phase["priCode"], "500 SCHEDULED")
+
+    def test_deprioritize(self):
+        self.assertTrue(self.api.deprioritize("100", "001"))
+        self.assertEqual(self.phase["priCode"], "500 SCHEDULED")
+
+    def test_add_hrc(self):
+        self.assertTrue(self.api.add_hrc("100", "001", "12"))
+        self.assertEqual(self.phase["description"], "replace ballast\nHRC12")
+
+    def test_unapplied_write_fails(self):
+        self.server.ignored.add(("100", "001"))
+        self.assertFalse(self.api.change_status("100", "001", "CANCEL"))
+        self.assertFalse(self.api.add_hrc("100", "001", "12"))
+
+    def test_failed_login_fails(self):
+        self.get_cookies.side_effect = ValueError("netid must be provided")
+        self.assertFalse(self.api.change_status("100", "001", "CANCEL"))
+        self.assertEqual(self.phase["statusCode"], "OPEN")
+
+    def test_unknown_phase_fails(self):
+        self.assertFalse(self.api.change_status("999", "001", "CANCEL"))
+        self.assertIsNone(self.api.get_phase("999", "001"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from datetime import datetime, timedelta
+
+from aim_helper.schedule import DEFAULT_INTERVAL, in_window, next_run
+
+# Monday
+MONDAY = datetime(2024, 5, 6, 12, 0)
+WORKDAY = {"interval": 600, "hours": [6, 18], "days": [0, 1, 2, 3, 4]}
+
+
+class ScheduleTest(unittest.TestCase):
+    def test_in_window(self):
+        self.assertTrue(in_window(WORKDAY, MONDAY))
+        self.assertFalse(in_window(WORKDAY, MONDAY.replace(hour=18)))
+        self.assertFalse(in_window(WORKDAY, MONDAY.replace(hour=5, minute=59)))
+        self.assertFalse(in_window(WORKDAY, MONDAY + timedelta(days=5)))
+        self.assertTrue(in_window(dict(), MONDAY + timedelta(days=5)))
+
+    def test_interval(self):
+        self.assertEqual(
+            next_run({"interval": 60}, MONDAY), MONDAY + timedelta(seconds=60)
+        )
+        self.assertEqual(
+            next_run(dict(), MONDAY), MONDAY + timedelta(seconds=DEFAULT_INTERVAL)
+        )
+
+    def test_jitter(self):
+        schedule = {"interval": 60, "jitter": 10}
+        for _ in range(100):
+            wait = (next_run(schedule, MONDAY) - MONDAY).total_seconds()
+            self.assertTrue(50 <= wait <= 70, wait)
+
+    def test_in_hours(self):
+        self.assertEqual(next_run(WORKDAY, MONDAY), MONDAY + timedelta(seconds=600))
+
+    def test_after_hours_waits_for_morning(self):
+        evening = MONDAY.replace(hour=17, minute=55)
+        self.assertEqual(next_run(WORKDAY, evening), datetime(2024, 5, 7, 6, 0))
+
+    def test_weekend_waits_for_monday(self):
+        friday = datetime(2024, 5, 10, 17, 55)
+        self.assertEqual(next_run(WORKDAY, friday), datetime(2024, 5, 13, 6, 0))
+
+    def test_no_window_uses_interval(self):
+        never = {"interval": 600, "days": []}
+        with self.assertLogs("aim_helper.schedule", "ERROR"):
+            when = next_run(never, MONDAY)
+        self.assertEqual(when, MONDAY + timedelta(seconds=600))
+
+
+if __name__ == "__main__":
+    unittest.main()